@@ -0,0 +1,48 @@
+"""
+Per-Object Access Statistics
+Shared cache of the access aggregates used by placement optimization and ML features
+"""
+import threading
+from datetime import datetime, timedelta
+from cachetools import TTLCache
+from sqlalchemy import case, func, select
+from models import AccessLog
+from config import ACCESS_STATS_CACHE_SIZE, ACCESS_STATS_CACHE_TTL_SECONDS
+
+ACCESS_STATS_WINDOW_DAYS = 30
+
+_cache = TTLCache(maxsize=ACCESS_STATS_CACHE_SIZE, ttl=ACCESS_STATS_CACHE_TTL_SECONDS)
+_lock = threading.Lock()
+# Bumped by each invalidation, so a read that raced one isn't cached
+_generations = {}
+
+def get_access_stats(db, data_object_id):
+    """Return (accesses in the last 30 days, last access, average latency) for an object"""
+    with _lock:
+        stats = _cache.get(data_object_id)
+        generation = _generations.get(data_object_id, 0)
+    if stats is not None:
+        return stats
+    
+    # All three aggregates in one pass; only the count is limited to the
+    # window, last access and average latency cover all history
+    cutoff_date = datetime.utcnow() - timedelta(days=ACCESS_STATS_WINDOW_DAYS)
+    row = db.execute(
+        select(
+            func.count(case((AccessLog.accessed_at >= cutoff_date, AccessLog.id))),
+            func.max(AccessLog.accessed_at),
+            func.avg(AccessLog.latency_ms)
+        ).where(AccessLog.data_object_id == data_object_id)
+    ).one()
+    stats = tuple(row)
+    
+    with _lock:
+        if _generations.get(data_object_id, 0) == generation:
+            _cache[data_object_id] = stats
+    return stats
+
+def invalidate_access_stats(data_object_id):
+    """Drop cached statistics for an object after logging an access to it"""
+    with _lock:
+        _cache.pop(data_object_id, None)
+        _generations[data_object_id] = _generations.get(data_object_id, 0) + 1
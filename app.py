@@ -2,28 +2,73 @@
 Main Flask Application for Intelligent Data Management System
 Provides REST API and WebSocket support for real-time updates
 """
-from flask import Flask, request, jsonify, render_template
+from config import SOCKETIO_ASYNC_MODE
+
+if SOCKETIO_ASYNC_MODE == 'eventlet':
+    # Must patch sockets/threads before anything else imports them
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 from datetime import datetime, timedelta
-from sqlalchemy import func
+from sqlalchemy import func, select
+from collections import deque
+from cachetools import TTLCache
+import atexit
 import json
+import orjson
 import os
 import threading
 
-from models import init_db, DataObject, AccessLog, Migration, StreamingEvent, MLPrediction, SessionLocal
+from models import init_db, DataObject, AccessLog, Migration, StreamingEvent, MLPrediction, db_session
 from data_placement_optimizer import DataPlacementOptimizer
 from migration_service import MigrationService
 from streaming_processor import StreamingProcessor
 from ml_predictor import MLPredictor
 from data_consistency_manager import DataConsistencyManager
-from config import API_HOST, API_PORT, DEBUG
+from access_stats import invalidate_access_stats
+from config import (
+    TIER_COST_PER_GB, API_HOST, API_PORT, DEBUG, STATS_CACHE_TTL_SECONDS,
+    BACKGROUND_SERVICES_AUTOSTART, STREAMING_AUTOSTART_INTERVAL,
+    DATA_OBJECTS_PAGE_SIZE, DB_STREAM_BATCH_SIZE,
+    ACCESS_EMIT_INTERVAL_SECONDS, ACCESS_EMIT_BATCH_SIZE, ACCESS_EMIT_QUEUE_MAX
+)
+
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson (C serializer with native numpy support)"""
+    option = orjson.OPT_SERIALIZE_NUMPY
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=self.option), mimetype='application/json'
+        )
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'netapp-hackathon-2024'
+app.json = ORJSONProvider(app)
+# Brotli (gzip fallback) for JSON list responses; tiny payloads aren't worth it
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_ALGORITHM_STREAMING'] = ['br', 'gzip']  # Streamed listings use their own list
+app.config['COMPRESS_BR_LEVEL'] = 5
+app.config['COMPRESS_MIN_SIZE'] = 1024
 CORS(app)
-# Use threading mode instead of eventlet for Python 3.13 compatibility
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+Compress(app)
+# Threading mode by default for Python 3.13 compatibility (see SOCKETIO_ASYNC_MODE)
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=SOCKETIO_ASYNC_MODE, json=app.json)
+
+# Columns serialized by the data-object list endpoint (same fields as to_dict)
+_DATA_OBJECT_COLUMNS = [DataObject.__table__.c[name] for name in DataObject.SERIALIZED_COLUMNS]
 
 # Initialize database
 init_db()
@@ -32,12 +77,89 @@ init_db()
 optimizer = DataPlacementOptimizer()
 migration_service = MigrationService()
 streaming_processor = StreamingProcessor(use_kafka=False, use_mqtt=False)
+# Write out pending access counts on shutdown
+atexit.register(streaming_processor.close)
 ml_predictor = MLPredictor()
 consistency_manager = DataConsistencyManager()
 
 # Start streaming processor simulation
 streaming_thread = None
 
+def _task_running(task):
+    """Whether a background task (OS thread or green thread) is still running"""
+    if task is None:
+        return False
+    if hasattr(task, 'is_alive'):
+        return task.is_alive()
+    return not task.dead
+
+_background_started = False
+_background_lock = threading.Lock()
+
+def _train_model_in_background():
+    """Initial model training, off the request path"""
+    try:
+        ml_predictor.train_model()
+    except Exception as e:
+        print(f"ML model training skipped: {e}")
+    finally:
+        # Not a request, so the teardown handler won't release this session
+        db_session.remove()
+
+def _start_background_services():
+    """Start stream simulation and model training once, on first client connect"""
+    global _background_started, streaming_thread
+    with _background_lock:
+        if _background_started or not BACKGROUND_SERVICES_AUTOSTART:
+            return
+        _background_started = True
+    
+    socketio.start_background_task(_train_model_in_background)
+    if not _task_running(streaming_thread):
+        streaming_thread = socketio.start_background_task(
+            streaming_processor.simulate_data_stream, STREAMING_AUTOSTART_INTERVAL
+        )
+
+# Access events are queued by log_access and flushed in batches by a single
+# background task, so a request never pays for the WebSocket fan-out itself
+_emit_queue = deque(maxlen=ACCESS_EMIT_QUEUE_MAX)
+_emit_lock = threading.Lock()
+_emit_ready = threading.Event()
+
+def _flush_access_events():
+    """Emit queued access events as one batch per flush interval"""
+    global _emit_queue
+    while True:
+        _emit_ready.wait(ACCESS_EMIT_INTERVAL_SECONDS)
+        _emit_ready.clear()
+        
+        with _emit_lock:
+            if not _emit_queue:
+                continue
+            batch, _emit_queue = _emit_queue, deque(maxlen=ACCESS_EMIT_QUEUE_MAX)
+        
+        try:
+            socketio.emit('access_logged_batch', [access for access, _ in batch])
+            streaming_processor.publish_events('data-stream', [event for _, event in batch])
+        except Exception as e:
+            print(f"Error flushing access events: {e}")
+
+socketio.start_background_task(_flush_access_events)
+
+# Short-lived cache for /api/stats; writes that change the numbers drop it
+_stats_cache = TTLCache(maxsize=1, ttl=STATS_CACHE_TTL_SECONDS)
+_stats_lock = threading.Lock()
+
+def _invalidate_stats():
+    """Drop cached dashboard statistics"""
+    with _stats_lock:
+        _stats_cache.pop('stats', None)
+
+@app.teardown_appcontext
+def shutdown_session(exception=None):
+    """Return the request's database session to the pool"""
+    db_session.remove()
+
 @app.route('/')
 def index():
     """Serve the main dashboard"""
@@ -55,100 +177,107 @@ def health():
 # Data Object Endpoints
 @app.route('/api/data-objects', methods=['GET'])
 def get_data_objects():
-    """Get all data objects"""
-    db = SessionLocal()
-    try:
-        objects = db.query(DataObject).all()
-        return jsonify([obj.to_dict() for obj in objects])
-    finally:
-        db.close()
+    """Get data objects, a page at a time (keyset pagination on id)"""
+    limit = request.args.get('limit', DATA_OBJECTS_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor', 0, type=int)
+    
+    # Plain column rows: no ORM identity map or to_dict() per object. orjson
+    # renders the datetimes natively, in the same format as isoformat().
+    rows = db_session.execute(
+        select(*_DATA_OBJECT_COLUMNS).where(
+            DataObject.id > cursor
+        ).order_by(DataObject.id).limit(limit).execution_options(
+            yield_per=DB_STREAM_BATCH_SIZE
+        )
+    )
+    
+    # Serialize rows as they arrive instead of materializing the whole page
+    def generate():
+        yield b'['
+        for i, row in enumerate(rows):
+            if i:
+                yield b','
+            yield orjson.dumps(row._asdict())
+        yield b']'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/api/data-objects', methods=['POST'])
 def create_data_object():
     """Create a new data object"""
-    db = SessionLocal()
-    try:
-        data = request.json
-        
-        obj = DataObject(
-            name=data.get('name', f'object_{datetime.utcnow().timestamp()}'),
-            size_gb=data.get('size_gb', 1.0),
-            current_tier=data.get('tier', 'warm'),
-            current_location=data.get('location', 'On-Premise Data Center'),
-            cloud_provider=data.get('cloud_provider'),
-            region=data.get('region'),
-            content_type=data.get('content_type'),
-            encrypted=data.get('encrypted', False)
-        )
-        
-        # Calculate initial cost
-        from config import STORAGE_TIERS
-        tier_config = STORAGE_TIERS.get(obj.current_tier, {})
-        obj.monthly_cost = tier_config.get('cost_per_gb', 0) * obj.size_gb
-        
-        db.add(obj)
-        db.commit()
-        db.refresh(obj)
-        
-        # Emit event
-        socketio.emit('data_object_created', obj.to_dict())
-        
-        return jsonify(obj.to_dict()), 201
-    finally:
-        db.close()
+    data = request.json
+    
+    obj = DataObject(
+        name=data.get('name', f'object_{datetime.utcnow().timestamp()}'),
+        size_gb=data.get('size_gb', 1.0),
+        current_tier=data.get('tier', 'warm'),
+        current_location=data.get('location', 'On-Premise Data Center'),
+        cloud_provider=data.get('cloud_provider'),
+        region=data.get('region'),
+        content_type=data.get('content_type'),
+        encrypted=data.get('encrypted', False)
+    )
+    
+    # Calculate initial cost
+    obj.monthly_cost = TIER_COST_PER_GB.get(obj.current_tier, 0.0) * obj.size_gb
+    
+    db_session.add(obj)
+    db_session.commit()
+    db_session.refresh(obj)
+    _invalidate_stats()
+    
+    # Emit event
+    socketio.emit('data_object_created', obj.to_dict())
+    
+    return jsonify(obj.to_dict()), 201
 
 @app.route('/api/data-objects/<int:obj_id>', methods=['GET'])
 def get_data_object(obj_id):
     """Get a specific data object"""
-    db = SessionLocal()
-    try:
-        obj = db.query(DataObject).filter(DataObject.id == obj_id).first()
-        if not obj:
-            return jsonify({'error': 'Not found'}), 404
-        return jsonify(obj.to_dict())
-    finally:
-        db.close()
+    obj = db_session.get(DataObject, obj_id)
+    if not obj:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(obj.to_dict())
 
 @app.route('/api/data-objects/<int:obj_id>/access', methods=['POST'])
 def log_access(obj_id):
     """Log data access"""
-    db = SessionLocal()
-    try:
-        obj = db.query(DataObject).filter(DataObject.id == obj_id).first()
-        if not obj:
-            return jsonify({'error': 'Not found'}), 404
-        
-        data = request.json
-        access_log = AccessLog(
-            data_object_id=obj_id,
-            access_type=data.get('access_type', 'read'),
-            latency_ms=data.get('latency_ms'),
-            source_ip=data.get('source_ip', request.remote_addr)
-        )
-        
-        db.add(access_log)
-        
-        # Update object metrics
-        obj.access_count += 1
-        obj.last_accessed = datetime.utcnow()
-        
-        db.commit()
-        
-        # Emit event
-        socketio.emit('access_logged', access_log.to_dict())
-        
-        # Publish streaming event
-        streaming_processor.publish_event('data-stream', {
+    obj = db_session.get(DataObject, obj_id)
+    if not obj:
+        return jsonify({'error': 'Not found'}), 404
+    
+    data = request.json
+    access_log = AccessLog(
+        data_object_id=obj_id,
+        access_type=data.get('access_type', 'read'),
+        latency_ms=data.get('latency_ms'),
+        source_ip=data.get('source_ip', request.remote_addr)
+    )
+    
+    db_session.add(access_log)
+    
+    # Update object metrics
+    obj.access_count += 1
+    obj.last_accessed = datetime.utcnow()
+    
+    db_session.commit()
+    _invalidate_stats()
+    invalidate_access_stats(obj_id)
+    result = access_log.to_dict()
+    
+    # Queue WebSocket + streaming events for the background flusher
+    with _emit_lock:
+        _emit_queue.append((result, {
             'type': 'access_event',
             'data_object_id': obj_id,
             'access_type': data.get('access_type', 'read'),
             'latency_ms': data.get('latency_ms'),
             'timestamp': datetime.utcnow().isoformat()
-        })
-        
-        return jsonify(access_log.to_dict()), 201
-    finally:
-        db.close()
+        }))
+        if len(_emit_queue) >= ACCESS_EMIT_BATCH_SIZE:
+            _emit_ready.set()
+    
+    return jsonify(result), 201
 
 # Optimization Endpoints
 @app.route('/api/optimize/<int:obj_id>', methods=['POST'])
@@ -178,7 +307,10 @@ def get_migrations():
     if status:
         migrations = migration_service.get_active_migrations()
     else:
-        migrations = migration_service.get_migration_history()
+        migrations = migration_service.get_migration_history(
+            limit=request.args.get('limit', 50, type=int),
+            before=request.args.get('before', type=int)
+        )
     return jsonify(migrations)
 
 @app.route('/api/migrations', methods=['POST'])
@@ -197,6 +329,8 @@ def create_migration():
     if not migration:
         return jsonify({'error': 'Failed to create migration'}), 400
     
+    _invalidate_stats()
+    
     # Execute migration
     result = migration_service.execute_migration(migration['id'], simulate=True)
     
@@ -252,16 +386,13 @@ def train_model():
 def start_streaming():
     """Start data streaming simulation"""
     global streaming_thread
-    if streaming_thread and streaming_thread.is_alive():
+    if _task_running(streaming_thread):
         return jsonify({'error': 'Streaming already running'}), 400
     
     interval = request.json.get('interval', 5) if request.json else 5
-    streaming_thread = threading.Thread(
-        target=streaming_processor.simulate_data_stream,
-        args=(interval,),
-        daemon=True
+    streaming_thread = socketio.start_background_task(
+        streaming_processor.simulate_data_stream, interval
     )
-    streaming_thread.start()
     
     return jsonify({'status': 'streaming_started', 'interval': interval})
 
@@ -274,15 +405,22 @@ def stop_streaming():
 @app.route('/api/streaming/events', methods=['GET'])
 def get_streaming_events():
     """Get recent streaming events"""
-    db = SessionLocal()
-    try:
-        limit = request.args.get('limit', 50, type=int)
-        events = db.query(StreamingEvent).order_by(
-            StreamingEvent.timestamp.desc()
-        ).limit(limit).all()
-        return jsonify([e.to_dict() for e in events])
-    finally:
-        db.close()
+    limit = request.args.get('limit', 50, type=int)
+    before = request.args.get('before', type=int)
+    
+    # Latest page straight from the processor's ring buffer when it's full enough
+    recent = streaming_processor.recent
+    if before is None and 0 < limit <= len(recent):
+        events = list(recent)[-limit:]
+        events.reverse()
+        return jsonify(events)
+    
+    # Keyset pagination: newest first, `before` is the last id of the previous page
+    query = db_session.query(StreamingEvent)
+    if before:
+        query = query.filter(StreamingEvent.id < before)
+    events = query.order_by(StreamingEvent.id.desc()).limit(limit).all()
+    return jsonify([e.to_dict() for e in events])
 
 # Consistency Endpoints
 @app.route('/api/consistency/<int:obj_id>', methods=['GET'])
@@ -296,48 +434,70 @@ def get_consistency(obj_id):
 @app.route('/api/consistency/<int:obj_id>/verify', methods=['POST'])
 def verify_consistency(obj_id):
     """Verify data consistency"""
+    obj = db_session.get(DataObject, obj_id)
+    if not obj:
+        return jsonify({'error': 'Data object not found'}), 404
+    
     locations = request.json.get('locations') if request.json else None
-    result = consistency_manager.verify_consistency(obj_id, locations)
+    result = consistency_manager.verify_consistency(obj, locations)
     return jsonify(result)
 
 # Dashboard Statistics
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get dashboard statistics"""
-    db = SessionLocal()
-    try:
-        total_objects = db.query(DataObject).count()
-        total_size = db.query(func.sum(DataObject.size_gb)).scalar() or 0
-        total_cost = db.query(func.sum(DataObject.monthly_cost)).scalar() or 0
-        
-        tier_distribution = {}
-        for tier in ['hot', 'warm', 'cold']:
-            count = db.query(DataObject).filter(DataObject.current_tier == tier).count()
+    with _stats_lock:
+        cached = _stats_cache.get('stats')
+    if cached is not None:
+        return jsonify(cached)
+    
+    # Totals and tier distribution in one pass over data_objects
+    tier_rows = db_session.query(
+        DataObject.current_tier,
+        func.count(DataObject.id),
+        func.sum(DataObject.size_gb),
+        func.sum(DataObject.monthly_cost)
+    ).group_by(DataObject.current_tier).all()
+    
+    total_objects = 0
+    total_size = 0
+    total_cost = 0
+    tier_distribution = {'hot': 0, 'warm': 0, 'cold': 0}
+    for tier, count, size, cost in tier_rows:
+        total_objects += count
+        total_size += size or 0
+        total_cost += cost or 0
+        if tier in tier_distribution:
             tier_distribution[tier] = count
-        
-        active_migrations = db.query(Migration).filter(
+    
+    # Migration and access counts in a single round-trip
+    active_migrations, recent_accesses = db_session.execute(select(
+        select(func.count(Migration.id)).where(
             Migration.status.in_(['pending', 'in_progress'])
-        ).count()
-        
-        recent_accesses = db.query(AccessLog).filter(
+        ).scalar_subquery(),
+        select(func.count(AccessLog.id)).where(
             AccessLog.accessed_at >= datetime.utcnow() - timedelta(hours=24)
-        ).count()
-        
-        return jsonify({
-            'total_objects': total_objects,
-            'total_size_gb': round(total_size, 2),
-            'total_monthly_cost': round(total_cost, 2),
-            'tier_distribution': tier_distribution,
-            'active_migrations': active_migrations,
-            'recent_accesses_24h': recent_accesses
-        })
-    finally:
-        db.close()
+        ).scalar_subquery()
+    )).one()
+    
+    stats = {
+        'total_objects': total_objects,
+        'total_size_gb': round(total_size, 2),
+        'total_monthly_cost': round(total_cost, 2),
+        'tier_distribution': tier_distribution,
+        'active_migrations': active_migrations,
+        'recent_accesses_24h': recent_accesses
+    }
+    with _stats_lock:
+        _stats_cache['stats'] = stats
+    
+    return jsonify(stats)
 
 # WebSocket Events
 @socketio.on('connect')
 def handle_connect():
     """Handle WebSocket connection"""
+    _start_background_services()
     emit('connected', {'message': 'Connected to data management system'})
 
 @socketio.on('disconnect')
@@ -349,21 +509,8 @@ if __name__ == '__main__':
     # Initialize database
     init_db()
     
-    # Train ML model on startup (if data exists)
-    try:
-        ml_predictor.train_model()
-    except Exception as e:
-        print(f"ML model training skipped: {e}")
-    
-    # Start streaming simulation
-    import threading
-    streaming_thread = threading.Thread(
-        target=streaming_processor.simulate_data_stream,
-        args=(10,),
-        daemon=True
-    )
-    streaming_thread.start()
+    # Streaming simulation and ML training start on the first client
+    # connection (see _start_background_services), not at boot
     
     # Run application
     socketio.run(app, host=API_HOST, port=API_PORT, debug=DEBUG)
-
@@ -31,6 +31,10 @@ STORAGE_TIERS = {
     }
 }
 
+# Flat per-tier lookups for hot paths (STORAGE_TIERS doesn't change at runtime)
+TIER_COST_PER_GB = {tier: cfg['cost_per_gb'] for tier, cfg in STORAGE_TIERS.items()}
+TIER_LATENCY_MS = {tier: cfg['latency_ms'] for tier, cfg in STORAGE_TIERS.items()}
+
 # Cloud Provider Configurations
 CLOUD_PROVIDERS = {
     'aws': {
@@ -56,22 +60,56 @@ CLOUD_PROVIDERS = {
 
 # Streaming Configuration
 KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092')
+KAFKA_GROUP_ID = os.getenv('KAFKA_GROUP_ID', 'data-management')  # Consumer group owning committed offsets
 MQTT_BROKER = os.getenv('MQTT_BROKER', 'localhost')
 MQTT_PORT = int(os.getenv('MQTT_PORT', 1883))
 MQTT_TOPIC = 'data/stream'
+STREAMING_RECENT_EVENTS = 1000  # Processed events kept in memory for the events endpoint
+KAFKA_MAX_POLL_RECORDS = 500  # Events stored per transaction and offset commit
+KAFKA_POLL_TIMEOUT_MS = 500
+# Broker holds each fetch until this much data is ready (or the wait expires)
+# rather than answering as soon as a single small event arrives
+KAFKA_FETCH_MIN_BYTES = 64 * 1024
+KAFKA_FETCH_MAX_WAIT_MS = 200
+KAFKA_MAX_PARTITION_FETCH_BYTES = 5 * 1024 * 1024
+# Streamed accesses are counted in memory and added to data_objects.access_count
+# at most this often, or once this many are pending
+STREAMING_ACCESS_FLUSH_INTERVAL_SECONDS = 5
+STREAMING_ACCESS_FLUSH_MAX_PENDING = 1000
+STREAMING_HANDLER_WORKERS = 8  # Threads running custom event handlers off the ingest path
+STREAMING_HANDLER_MAX_PENDING = 32  # Handler batches queued before ingestion waits
+# Producer batching: sends wait up to linger for a batch to fill instead of
+# flushing per event
+KAFKA_PRODUCER_LINGER_MS = 100
+KAFKA_PRODUCER_BATCH_SIZE = 64000  # bytes
+KAFKA_COMPRESSION_TYPE = os.getenv('KAFKA_COMPRESSION_TYPE', 'lz4')
 
 # Database Configuration
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///data_management.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_RECYCLE_SECONDS = 1800
+DB_QUERY_CACHE_SIZE = 1200  # Compiled SQL statements kept per engine (SQLAlchemy default 500)
+DB_EXECUTEMANY_PAGE_SIZE = 1000  # Rows per multi-VALUES INSERT / batched UPDATE round-trip
 
 # ML Model Configuration
 ML_MODEL_PATH = 'models/data_usage_predictor.pkl'
 ML_RETRAIN_INTERVAL_HOURS = 24
+# Objects this clearly hot or cold get the tier without consulting the model
+ML_EARLY_EXIT_HOT = {'accesses_per_day': 100, 'max_hours_since_access': 1}
+ML_EARLY_EXIT_COLD = {'accesses_per_day': 0.05, 'min_hours_since_access': 720}
+ML_EARLY_EXIT_CONFIDENCE = 0.99
 
 # Migration Configuration
 MIGRATION_BATCH_SIZE = 100  # MB
+MIGRATION_PROGRESS_CHECKPOINTS = 10  # Progress commits per migration
 MIGRATION_MAX_CONCURRENT = 5
 MIGRATION_RETRY_ATTEMPTS = 3
 
+# Consistency Configuration
+REPLICATION_STATUS_MAX_OBJECTS = 10000  # Least recently used entries are evicted
+CHECKSUM_CACHE_SIZE = 4096  # Memoized metadata checksums
+
 # Access Pattern Thresholds
 ACCESS_THRESHOLDS = {
     'hot': {'accesses_per_day': 100, 'last_access_hours': 24},
@@ -79,7 +117,33 @@ ACCESS_THRESHOLDS = {
     'cold': {'accesses_per_day': 1, 'last_access_hours': 720}   # 30 days
 }
 
+# WebSocket Configuration
+# 'threading' works everywhere (incl. Python 3.13); 'eventlet' multiplexes
+# many clients on green threads where eventlet is supported
+SOCKETIO_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE', 'threading')
+ACCESS_EMIT_INTERVAL_SECONDS = 0.05  # Flush queued access events every 50ms
+ACCESS_EMIT_BATCH_SIZE = 50  # ...or as soon as this many are queued
+ACCESS_EMIT_QUEUE_MAX = 10000
+
+# Dashboard statistics are cached for this long between polls
+STATS_CACHE_TTL_SECONDS = 10
+
+# Per-object access aggregates (count/last access/avg latency) used by the
+# optimizer and ML features; logging an access drops that object's entry
+ACCESS_STATS_CACHE_TTL_SECONDS = int(os.getenv('ACCESS_STATS_CACHE_TTL_SECONDS', 60))
+ACCESS_STATS_CACHE_SIZE = 10000
+
+# Background Services
+# Stream simulation and initial model training start on the first client
+# connection. Under a multi-worker server set this to false on all but one
+# worker so the work isn't duplicated N times.
+BACKGROUND_SERVICES_AUTOSTART = os.getenv('BACKGROUND_SERVICES_AUTOSTART', 'True').lower() == 'true'
+STREAMING_AUTOSTART_INTERVAL = 10  # seconds between simulated events
+
 # API Configuration
+DATA_OBJECTS_PAGE_SIZE = 500  # Default page size for /api/data-objects
+DB_STREAM_BATCH_SIZE = 200  # Rows fetched per round-trip when streaming results
+BATCH_PARALLEL_MIN_ROWS = int(os.getenv('BATCH_PARALLEL_MIN_ROWS', 200000))  # Batch scoring uses all cores from this size
 API_HOST = os.getenv('API_HOST', '0.0.0.0')
 API_PORT = int(os.getenv('API_PORT', 5000))
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
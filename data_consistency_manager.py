@@ -2,55 +2,68 @@
 Data Consistency and Availability Manager
 Handles synchronization and conflict resolution across distributed environments
 """
+import functools
 import hashlib
 import json
 from datetime import datetime, timedelta
-from sqlalchemy import and_
-from models import DataObject, Migration, SessionLocal
-from config import STORAGE_TIERS
+from cachetools import LRUCache
+from sqlalchemy import and_, func, select
+from models import DataObject, Migration, db_session
+from config import STORAGE_TIERS, REPLICATION_STATUS_MAX_OBJECTS, CHECKSUM_CACHE_SIZE
 import threading
 
+@functools.lru_cache(maxsize=CHECKSUM_CACHE_SIZE)
+def _metadata_checksum(data_object_id, name, size_gb, last_accessed):
+    """Checksum of object metadata; keyed on every input, so never stale"""
+    # In real implementation, this would calculate actual file checksum
+    # For simulation, we use object metadata
+    content = f"{data_object_id}_{name}_{size_gb}_{last_accessed}"
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
 class DataConsistencyManager:
     """Manages data consistency and availability across distributed storage"""
     
     def __init__(self):
-        self.db = SessionLocal()
         self.sync_lock = threading.Lock()
-        self.replication_status = {}
+        # data_object_id -> {location: replication state}; bounded so a
+        # long-running server doesn't accumulate finished replications.
+        # LRUCache reorders on read, so every access goes through sync_lock.
+        self.replication_status = LRUCache(maxsize=REPLICATION_STATUS_MAX_OBJECTS)
     
-    def calculate_checksum(self, data_object_id):
-        """Calculate checksum for a data object (simulated)"""
-        data_object = self.db.query(DataObject).filter(
-            DataObject.id == data_object_id
-        ).first()
-        
-        if not data_object:
-            return None
-        
-        # In real implementation, this would calculate actual file checksum
-        # For simulation, we use object metadata
-        content = f"{data_object.id}_{data_object.name}_{data_object.size_gb}_{data_object.last_accessed}"
-        checksum = hashlib.md5(content.encode()).hexdigest()
-        
-        return checksum
+    @property
+    def db(self):
+        """Session for the calling thread (released by the app's teardown handler)"""
+        return db_session()
     
-    def verify_consistency(self, data_object_id, locations=None):
+    def calculate_checksum(self, data_object):
+        """Calculate checksum for an already-loaded data object (simulated)"""
+        return _metadata_checksum(
+            data_object.id, data_object.name, data_object.size_gb, data_object.last_accessed
+        )
+    
+    def batch_checksum(self, rows):
+        """Checksums for many objects (ORM objects or column rows) in one pass"""
+        # Bypasses the memo cache so a full sweep doesn't evict hot entries;
+        # digests are identical to calculate_checksum
+        blake2b = hashlib.blake2b
+        return [
+            blake2b(
+                f"{row.id}_{row.name}_{row.size_gb}_{row.last_accessed}".encode(),
+                digest_size=16
+            ).hexdigest()
+            for row in rows
+        ]
+    
+    def verify_consistency(self, data_object, locations=None):
         """Verify data consistency across multiple locations"""
-        data_object = self.db.query(DataObject).filter(
-            DataObject.id == data_object_id
-        ).first()
-        
-        if not data_object:
-            return {'error': 'Data object not found'}
-        
         # Calculate primary checksum
-        primary_checksum = self.calculate_checksum(data_object_id)
+        primary_checksum = self.calculate_checksum(data_object)
         
         # In real implementation, would compare checksums from all locations
         # For simulation, we assume consistency if no recent migrations
         recent_migrations = self.db.query(Migration).filter(
             and_(
-                Migration.data_object_id == data_object_id,
+                Migration.data_object_id == data_object.id,
                 Migration.status == 'in_progress',
                 Migration.started_at >= datetime.utcnow() - timedelta(hours=1)
             )
@@ -59,22 +72,15 @@ class DataConsistencyManager:
         is_consistent = recent_migrations == 0
         
         return {
-            'data_object_id': data_object_id,
+            'data_object_id': data_object.id,
             'checksum': primary_checksum,
             'is_consistent': is_consistent,
             'locations_checked': locations or [data_object.current_location],
             'timestamp': datetime.utcnow().isoformat()
         }
     
-    def handle_conflict(self, data_object_id, conflicting_versions):
+    def handle_conflict(self, data_object, conflicting_versions):
         """Handle data conflicts between versions"""
-        data_object = self.db.query(DataObject).filter(
-            DataObject.id == data_object_id
-        ).first()
-        
-        if not data_object:
-            return {'error': 'Data object not found'}
-        
         # Conflict resolution strategies:
         # 1. Last-write-wins (default)
         # 2. Version-based
@@ -91,28 +97,21 @@ class DataConsistencyManager:
             resolved_version = conflicting_versions[0]
         
         return {
-            'data_object_id': data_object_id,
+            'data_object_id': data_object.id,
             'conflict_resolved': True,
             'strategy': strategy,
             'resolved_version': resolved_version,
             'timestamp': datetime.utcnow().isoformat()
         }
     
-    def replicate_data(self, data_object_id, target_locations):
+    def replicate_data(self, data_object, target_locations):
         """Replicate data to multiple locations for availability"""
-        data_object = self.db.query(DataObject).filter(
-            DataObject.id == data_object_id
-        ).first()
-        
-        if not data_object:
-            return {'error': 'Data object not found'}
-        
         replication_tasks = []
         
         for location in target_locations:
             # Create replication task (simulated)
             task = {
-                'data_object_id': data_object_id,
+                'data_object_id': data_object.id,
                 'source_location': data_object.current_location,
                 'target_location': location,
                 'status': 'pending',
@@ -120,64 +119,51 @@ class DataConsistencyManager:
             }
             
             replication_tasks.append(task)
-            
-            # Update replication status
-            key = f"{data_object_id}_{location}"
-            self.replication_status[key] = {
-                'status': 'in_progress',
-                'started_at': datetime.utcnow(),
-                'progress': 0
-            }
+        
+        # Update replication status
+        with self.sync_lock:
+            replicas = self.replication_status.setdefault(data_object.id, {})
+            for location in target_locations:
+                replicas[location] = {
+                    'status': 'in_progress',
+                    'started_at': datetime.utcnow(),
+                    'progress': 0
+                }
         
         return {
-            'data_object_id': data_object_id,
+            'data_object_id': data_object.id,
             'replication_tasks': replication_tasks,
             'total_locations': len(target_locations) + 1  # +1 for primary
         }
     
-    def handle_network_failure(self, data_object_id, failed_location):
+    def handle_network_failure(self, data_object, failed_location):
         """Handle network failure for a specific location"""
         # Mark location as unavailable
-        key = f"{data_object_id}_{failed_location}"
-        if key in self.replication_status:
-            self.replication_status[key]['status'] = 'failed'
-            self.replication_status[key]['error'] = 'Network failure'
-        
-        # Check if data is available in other locations
-        data_object = self.db.query(DataObject).filter(
-            DataObject.id == data_object_id
-        ).first()
-        
-        if not data_object:
-            return {'error': 'Data object not found'}
+        with self.sync_lock:
+            replica = self.replication_status.get(data_object.id, {}).get(failed_location)
+            if replica:
+                replica['status'] = 'failed'
+                replica['error'] = 'Network failure'
         
         # In real implementation, would check other replicas
         is_available = data_object.current_location != failed_location
         
         return {
-            'data_object_id': data_object_id,
+            'data_object_id': data_object.id,
             'failed_location': failed_location,
             'is_available': is_available,
             'fallback_location': data_object.current_location if is_available else None,
             'timestamp': datetime.utcnow().isoformat()
         }
     
-    def ensure_availability(self, data_object_id, min_replicas=2):
+    def ensure_availability(self, data_object, min_replicas=2):
         """Ensure minimum number of replicas for availability"""
-        data_object = self.db.query(DataObject).filter(
-            DataObject.id == data_object_id
-        ).first()
-        
-        if not data_object:
-            return {'error': 'Data object not found'}
-        
-        # Count current replicas
-        current_replicas = 1  # Primary location
-        
-        # Check replication status
-        for key, status in self.replication_status.items():
-            if key.startswith(f"{data_object_id}_") and status['status'] == 'completed':
-                current_replicas += 1
+        # Count current replicas: primary location plus completed replications
+        with self.sync_lock:
+            replicas = self.replication_status.get(data_object.id, {})
+            current_replicas = 1 + sum(
+                1 for status in replicas.values() if status['status'] == 'completed'
+            )
         
         if current_replicas < min_replicas:
             # Create additional replicas
@@ -186,24 +172,19 @@ class DataConsistencyManager:
                 f"Replica-{i+1}" for i in range(additional_needed)
             ]
             
-            return self.replicate_data(data_object_id, target_locations)
+            return self.replicate_data(data_object, target_locations)
         
         return {
-            'data_object_id': data_object_id,
+            'data_object_id': data_object.id,
             'current_replicas': current_replicas,
             'min_replicas': min_replicas,
             'status': 'sufficient'
         }
     
-    def sync_across_environments(self, data_object_id, environments):
+    def sync_across_environments(self, data_object, environments):
         """Synchronize data across multiple cloud environments"""
-        data_object = self.db.query(DataObject).filter(
-            DataObject.id == data_object_id
-        ).first()
-        
-        if not data_object:
-            return {'error': 'Data object not found'}
-        
+        # Object metadata doesn't change between environments
+        checksum = self.calculate_checksum(data_object)
         sync_results = []
         
         for env in environments:
@@ -212,47 +193,43 @@ class DataConsistencyManager:
                 'environment': env,
                 'status': 'synced',
                 'timestamp': datetime.utcnow().isoformat(),
-                'checksum': self.calculate_checksum(data_object_id)
+                'checksum': checksum
             }
             sync_results.append(sync_result)
         
         return {
-            'data_object_id': data_object_id,
+            'data_object_id': data_object.id,
             'sync_results': sync_results,
             'total_environments': len(environments)
         }
     
     def get_consistency_status(self, data_object_id):
         """Get consistency status for a data object"""
-        data_object = self.db.query(DataObject).filter(
-            DataObject.id == data_object_id
+        # Checksum inputs and active migration count in a single round-trip
+        active_migrations = select(func.count(Migration.id)).where(
+            Migration.data_object_id == DataObject.id,
+            Migration.status.in_(['pending', 'in_progress'])
+        ).scalar_subquery()
+        
+        data_object = self.db.execute(
+            select(
+                DataObject.id, DataObject.name, DataObject.size_gb,
+                DataObject.last_accessed, DataObject.current_location,
+                active_migrations.label('active_migrations')
+            ).where(DataObject.id == data_object_id)
         ).first()
         
         if not data_object:
             return None
         
-        checksum = self.calculate_checksum(data_object_id)
-        
-        # Check for active migrations
-        active_migrations = self.db.query(Migration).filter(
-            and_(
-                Migration.data_object_id == data_object_id,
-                Migration.status.in_(['pending', 'in_progress'])
-            )
-        ).count()
-        
-        is_consistent = active_migrations == 0
+        checksum = self.calculate_checksum(data_object)
+        is_consistent = data_object.active_migrations == 0
         
         return {
             'data_object_id': data_object_id,
             'checksum': checksum,
             'is_consistent': is_consistent,
-            'active_migrations': active_migrations,
+            'active_migrations': data_object.active_migrations,
             'current_location': data_object.current_location,
             'timestamp': datetime.utcnow().isoformat()
         }
-    
-    def __del__(self):
-        if hasattr(self, 'db'):
-            self.db.close()
-
@@ -2,20 +2,73 @@
 Intelligent Data Placement Optimizer
 Determines optimal storage tier based on access patterns, cost, and latency requirements
 """
+import functools
 from datetime import datetime, timedelta
-from sqlalchemy import func
-from models import DataObject, AccessLog, SessionLocal
-from config import STORAGE_TIERS, ACCESS_THRESHOLDS
+from sqlalchemy import case, func, select
+from models import DataObject, AccessLog, db_session
+from access_stats import ACCESS_STATS_WINDOW_DAYS, get_access_stats
+from reasoning import render_reasoning
+from config import (
+    STORAGE_TIERS, TIER_COST_PER_GB, TIER_LATENCY_MS, ACCESS_THRESHOLDS,
+    BATCH_PARALLEL_MIN_ROWS
+)
 import math
+import os
+import joblib
+import numpy as np
+
+# Tier attributes as arrays indexed by position, for vectorized batch scoring
+_TIER_NAMES = tuple(STORAGE_TIERS)
+_TIER_INDEX = {tier: i for i, tier in enumerate(_TIER_NAMES)}
+_TIER_COST = np.array([TIER_COST_PER_GB[t] for t in _TIER_NAMES])
+_TIER_LATENCY = np.array([TIER_LATENCY_MS[t] for t in _TIER_NAMES])
+
+# Classification thresholds, unpacked once for the per-object and batch paths
+_HOT_ACCESSES_PER_DAY = ACCESS_THRESHOLDS['hot']['accesses_per_day']
+_HOT_LAST_ACCESS_HOURS = ACCESS_THRESHOLDS['hot']['last_access_hours']
+_WARM_ACCESSES_PER_DAY = ACCESS_THRESHOLDS['warm']['accesses_per_day']
+_WARM_LAST_ACCESS_HOURS = ACCESS_THRESHOLDS['warm']['last_access_hours']
+
+# With whole-number thresholds, accesses/day >= t iff floor(accesses/day) >= t
+# and hours <= t iff ceil(hours) <= t, so classifying integer bins is exact
+_CLASSIFY_ON_BINS = all(
+    float(threshold).is_integer() for threshold in (
+        _HOT_ACCESSES_PER_DAY, _HOT_LAST_ACCESS_HOURS,
+        _WARM_ACCESSES_PER_DAY, _WARM_LAST_ACCESS_HOURS
+    )
+)
+
+@functools.lru_cache(maxsize=4096)
+def _classify_tier(accesses_per_day, hours_since_access):
+    """Tier for an access rate and recency (memoized on integer bins)"""
+    # Hot tier: High frequency, recent access
+    if (accesses_per_day >= _HOT_ACCESSES_PER_DAY and 
+        hours_since_access <= _HOT_LAST_ACCESS_HOURS):
+        return 'hot'
+    
+    # Warm tier: Moderate frequency, somewhat recent
+    elif (accesses_per_day >= _WARM_ACCESSES_PER_DAY and 
+          hours_since_access <= _WARM_LAST_ACCESS_HOURS):
+        return 'warm'
+    
+    # Cold tier: Low frequency or old data
+    else:
+        return 'cold'
 
 class DataPlacementOptimizer:
     """Optimizes data placement across storage tiers"""
     
-    def __init__(self):
-        self.db = SessionLocal()
+    @property
+    def db(self):
+        """Session for the calling thread (released by the app's teardown handler)"""
+        return db_session()
     
     def calculate_access_frequency(self, data_object_id, days=30):
         """Calculate access frequency for a data object"""
+        if days == ACCESS_STATS_WINDOW_DAYS:
+            access_count, last_access, _ = get_access_stats(self.db, data_object_id)
+            return self._access_metrics(access_count, last_access, days)
+        
         cutoff_date = datetime.utcnow() - timedelta(days=days)
         
         # Get access count in the last N days
@@ -24,14 +77,18 @@ class DataPlacementOptimizer:
             AccessLog.accessed_at >= cutoff_date
         ).count()
         
-        # Calculate accesses per day
-        accesses_per_day = access_count / days if days > 0 else 0
-        
         # Get last access time
         last_access = self.db.query(func.max(AccessLog.accessed_at)).filter(
             AccessLog.data_object_id == data_object_id
         ).scalar()
         
+        return self._access_metrics(access_count, last_access, days)
+    
+    def _access_metrics(self, access_count, last_access, days=30):
+        """Build access metrics from a recent access count and last access time"""
+        # Calculate accesses per day
+        accesses_per_day = access_count / days if days > 0 else 0
+        
         if last_access:
             hours_since_access = (datetime.utcnow() - last_access).total_seconds() / 3600
         else:
@@ -41,7 +98,7 @@ class DataPlacementOptimizer:
             'accesses_per_day': accesses_per_day,
             'total_accesses': access_count,
             'hours_since_access': hours_since_access,
-            'last_access': last_access.isoformat() if last_access else None
+            'last_access': last_access
         }
     
     def classify_data_tier(self, access_metrics):
@@ -49,30 +106,20 @@ class DataPlacementOptimizer:
         accesses_per_day = access_metrics['accesses_per_day']
         hours_since_access = access_metrics['hours_since_access']
         
-        hot_threshold = ACCESS_THRESHOLDS['hot']
-        warm_threshold = ACCESS_THRESHOLDS['warm']
-        
-        # Hot tier: High frequency, recent access
-        if (accesses_per_day >= hot_threshold['accesses_per_day'] and 
-            hours_since_access <= hot_threshold['last_access_hours']):
-            return 'hot'
-        
-        # Warm tier: Moderate frequency, somewhat recent
-        elif (accesses_per_day >= warm_threshold['accesses_per_day'] and 
-              hours_since_access <= warm_threshold['last_access_hours']):
-            return 'warm'
-        
-        # Cold tier: Low frequency or old data
-        else:
+        # Never accessed: too stale for hot or warm
+        if math.isinf(hours_since_access):
             return 'cold'
+        
+        if _CLASSIFY_ON_BINS:
+            return _classify_tier(math.floor(accesses_per_day), math.ceil(hours_since_access))
+        return _classify_tier.__wrapped__(accesses_per_day, hours_since_access)
     
     def calculate_cost_benefit(self, data_object, target_tier):
         """Calculate cost benefit of moving to target tier"""
-        current_tier = data_object.current_tier
         size_gb = data_object.size_gb
         
-        current_cost = STORAGE_TIERS[current_tier]['cost_per_gb'] * size_gb
-        target_cost = STORAGE_TIERS[target_tier]['cost_per_gb'] * size_gb
+        current_cost = TIER_COST_PER_GB[data_object.current_tier] * size_gb
+        target_cost = TIER_COST_PER_GB[target_tier] * size_gb
         
         cost_savings = current_cost - target_cost
         cost_savings_percent = (cost_savings / current_cost * 100) if current_cost > 0 else 0
@@ -84,19 +131,39 @@ class DataPlacementOptimizer:
             'cost_savings_percent': cost_savings_percent
         }
     
-    def evaluate_latency_requirement(self, data_object, target_tier):
-        """Evaluate if target tier meets latency requirements"""
-        target_latency = STORAGE_TIERS[target_tier]['latency_ms']
-        
-        # Get average latency from access logs
-        avg_latency = self.db.query(func.avg(AccessLog.latency_ms)).filter(
-            AccessLog.data_object_id == data_object.id,
-            AccessLog.latency_ms.isnot(None)
-        ).scalar()
+    def _average_latency(self, data_object_id):
+        """Average observed access latency for a data object"""
+        _, _, avg_latency = get_access_stats(self.db, data_object_id)
         
         if avg_latency is None:
             avg_latency = 100  # Default assumption
         
+        return avg_latency
+    
+    def _batch_access_stats(self, data_object_ids, days=30):
+        """Recent access count, last access and average latency per object in one query"""
+        cutoff_date = datetime.utcnow() - timedelta(days=days)
+        
+        # Same windows as the per-object queries: only the count is limited
+        # to the last N days; AVG already skips NULL latencies
+        rows = self.db.query(
+            AccessLog.data_object_id,
+            func.count(case((AccessLog.accessed_at >= cutoff_date, AccessLog.id))),
+            func.max(AccessLog.accessed_at),
+            func.avg(AccessLog.latency_ms)
+        ).filter(
+            AccessLog.data_object_id.in_(data_object_ids)
+        ).group_by(AccessLog.data_object_id).all()
+        
+        return {row[0]: row[1:] for row in rows}
+    
+    def evaluate_latency_requirement(self, data_object, target_tier, avg_latency=None):
+        """Evaluate if target tier meets latency requirements"""
+        target_latency = TIER_LATENCY_MS[target_tier]
+        
+        if avg_latency is None:
+            avg_latency = self._average_latency(data_object.id)
+        
         # Check if target tier latency is acceptable (within 2x of current)
         latency_acceptable = target_latency <= avg_latency * 2
         
@@ -109,9 +176,10 @@ class DataPlacementOptimizer:
     
     def optimize_placement(self, data_object_id):
         """Determine optimal placement for a data object"""
-        data_object = self.db.query(DataObject).filter(
-            DataObject.id == data_object_id
-        ).first()
+        data_object = self.db.execute(
+            select(DataObject.id, DataObject.current_tier, DataObject.size_gb)
+            .where(DataObject.id == data_object_id)
+        ).one_or_none()
         
         if not data_object:
             return None
@@ -149,9 +217,9 @@ class DataPlacementOptimizer:
             'latency_analysis': latency_analysis,
             'optimization_score': score,
             'should_migrate': should_migrate,
-            'reasoning': self._generate_reasoning(
+            'reasoning': render_reasoning(self._generate_reasoning(
                 access_metrics, cost_analysis, latency_analysis, recommended_tier
-            )
+            ))
         }
     
     def _calculate_optimization_score(self, access_metrics, cost_analysis, latency_analysis, tier):
@@ -177,40 +245,201 @@ class DataPlacementOptimizer:
         return min(100, max(0, total_score))
     
     def _generate_reasoning(self, access_metrics, cost_analysis, latency_analysis, tier):
-        """Generate human-readable reasoning for placement recommendation"""
+        """Reason codes for a placement recommendation (see reasoning.render_reasoning)"""
         reasons = []
         
-        if access_metrics['accesses_per_day'] > 50:
-            reasons.append(f"High access frequency ({access_metrics['accesses_per_day']:.1f} accesses/day)")
-        elif access_metrics['accesses_per_day'] > 5:
-            reasons.append(f"Moderate access frequency ({access_metrics['accesses_per_day']:.1f} accesses/day)")
+        accesses_per_day = access_metrics['accesses_per_day']
+        if accesses_per_day > 50:
+            reasons.append(('HIGH_ACCESS', accesses_per_day))
+        elif accesses_per_day > 5:
+            reasons.append(('MODERATE_ACCESS', accesses_per_day))
         else:
-            reasons.append(f"Low access frequency ({access_metrics['accesses_per_day']:.1f} accesses/day)")
+            reasons.append(('LOW_ACCESS', accesses_per_day))
         
         if cost_analysis['cost_savings'] > 0:
-            reasons.append(f"Cost savings: ${cost_analysis['cost_savings']:.2f}/month ({cost_analysis['cost_savings_percent']:.1f}%)")
+            reasons.append(('COST_SAVINGS', cost_analysis['cost_savings'], cost_analysis['cost_savings_percent']))
         
         if latency_analysis['latency_acceptable']:
-            reasons.append(f"Latency acceptable: {latency_analysis['target_latency']}ms")
+            reasons.append(('LATENCY_OK', latency_analysis['target_latency']))
         else:
-            reasons.append(f"Latency concern: {latency_analysis['target_latency']}ms may be too high")
+            reasons.append(('LATENCY_CONCERN', latency_analysis['target_latency']))
         
-        return "; ".join(reasons)
+        return tuple(reasons)
+    
+    @staticmethod
+    def batch_score(accesses_per_day, hours_since_access, avg_latency, size_gb, current_tiers):
+        """Classify and score many objects at once (array-at-a-time version of
+        classify_data_tier, calculate_cost_benefit, evaluate_latency_requirement
+        and _calculate_optimization_score)"""
+        accesses_per_day = np.asarray(accesses_per_day, dtype=float)
+        hours_since_access = np.asarray(hours_since_access, dtype=float)
+        avg_latency = np.asarray(avg_latency, dtype=float)
+        size_gb = np.asarray(size_gb, dtype=float)
+        current_idx = np.array([_TIER_INDEX[t] for t in current_tiers], dtype=int)
+        
+        # Tier classification
+        is_hot = ((accesses_per_day >= _HOT_ACCESSES_PER_DAY) &
+                  (hours_since_access <= _HOT_LAST_ACCESS_HOURS))
+        is_warm = (~is_hot &
+                   (accesses_per_day >= _WARM_ACCESSES_PER_DAY) &
+                   (hours_since_access <= _WARM_LAST_ACCESS_HOURS))
+        tier_idx = np.where(is_hot, _TIER_INDEX['hot'],
+                            np.where(is_warm, _TIER_INDEX['warm'], _TIER_INDEX['cold']))
+        
+        # Cost benefit
+        current_cost = _TIER_COST[current_idx] * size_gb
+        target_cost = _TIER_COST[tier_idx] * size_gb
+        cost_savings = current_cost - target_cost
+        cost_savings_percent = np.divide(
+            cost_savings * 100, current_cost,
+            out=np.zeros_like(cost_savings), where=current_cost > 0
+        )
+        
+        # Latency
+        target_latency = _TIER_LATENCY[tier_idx]
+        latency_acceptable = target_latency <= avg_latency * 2
+        latency_penalty = target_latency - avg_latency
+        
+        # Optimization score (0-100)
+        access_score = np.where(
+            is_hot, np.minimum(40, accesses_per_day * 0.4),
+            np.where(is_warm, np.minimum(30, accesses_per_day * 3), 20)
+        )
+        cost_score = np.minimum(30, cost_savings_percent * 0.3)
+        latency_score = np.where(
+            latency_acceptable, 30 - np.minimum(30, latency_penalty * 0.1), 0
+        )
+        score = np.clip(access_score + cost_score + latency_score, 0, 100)
+        
+        should_migrate = (
+            (tier_idx != current_idx) &
+            (cost_savings > 0.01) &  # At least $0.01 savings
+            latency_acceptable
+        )
+        
+        return {
+            'tier_idx': tier_idx,
+            'current_cost': current_cost,
+            'target_cost': target_cost,
+            'cost_savings': cost_savings,
+            'cost_savings_percent': cost_savings_percent,
+            'target_latency': target_latency,
+            'latency_acceptable': latency_acceptable,
+            'latency_penalty': latency_penalty,
+            'optimization_score': score,
+            'should_migrate': should_migrate
+        }
+    
+    def _score_batch(self, accesses_per_day, hours_since_access, avg_latency, size_gb, current_tiers):
+        """batch_score, split across worker processes for very large batches"""
+        # Below the threshold one vectorized pass beats the cost of starting
+        # workers and pickling arrays to them
+        n_jobs = os.cpu_count() or 1
+        if len(current_tiers) < BATCH_PARALLEL_MIN_ROWS or n_jobs == 1:
+            return self.batch_score(
+                accesses_per_day, hours_since_access, avg_latency, size_gb, current_tiers
+            )
+        
+        # Workers get plain arrays (no session), one shard per core
+        shards = np.array_split(np.arange(len(current_tiers)), n_jobs)
+        columns = [
+            np.asarray(accesses_per_day, dtype=float),
+            np.asarray(hours_since_access, dtype=float),
+            np.asarray(avg_latency, dtype=float),
+            np.asarray(size_gb, dtype=float),
+            np.asarray(current_tiers, dtype=object)
+        ]
+        parts = joblib.Parallel(n_jobs=n_jobs, backend='loky')(
+            joblib.delayed(self.batch_score)(*(column[shard] for column in columns))
+            for shard in shards
+        )
+        return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
     
     def batch_optimize(self, limit=100):
         """Optimize placement for multiple data objects"""
-        data_objects = self.db.query(DataObject).limit(limit).all()
-        results = []
+        data_objects = self.db.execute(
+            select(DataObject.id, DataObject.current_tier, DataObject.size_gb).limit(limit)
+        ).all()
+        if not data_objects:
+            return []
+        
+        stats = self._batch_access_stats([obj.id for obj in data_objects])
+        access_count, last_access, avg_latency = zip(*(
+            stats.get(obj.id, (0, None, None)) for obj in data_objects
+        ))
+        avg_latency = [100 if latency is None else latency for latency in avg_latency]  # Default assumption
+        
+        # Access metrics for the whole batch against a single `now`; objects
+        # never accessed (NaT) are infinitely stale, as in _access_metrics
+        accesses_per_day = np.array(access_count) / 30
+        last_access_at = np.array(last_access, dtype='datetime64[us]')
+        hours_since_access = (
+            np.datetime64(datetime.utcnow(), 'us') - last_access_at
+        ) / np.timedelta64(1, 'h')
+        hours_since_access[np.isnan(hours_since_access)] = np.inf
+        
+        access_metrics = [
+            {
+                'accesses_per_day': per_day,
+                'total_accesses': count,
+                'hours_since_access': hours,
+                'last_access': last
+            }
+            for per_day, count, hours, last in zip(
+                accesses_per_day.tolist(), access_count, hours_since_access.tolist(), last_access
+            )
+        ]
+        
+        scored = self._score_batch(
+            accesses_per_day,
+            hours_since_access,
+            avg_latency,
+            [obj.size_gb for obj in data_objects],
+            [obj.current_tier for obj in data_objects]
+        )
+        # Back to Python scalars so results stay JSON-serializable
+        scored = {key: values.tolist() for key, values in scored.items()}
         
-        for obj in data_objects:
-            optimization = self.optimize_placement(obj.id)
-            if optimization:
-                results.append(optimization)
+        results = []
+        for i, obj in enumerate(data_objects):
+            recommended_tier = _TIER_NAMES[scored['tier_idx'][i]]
+            cost_analysis = {
+                'current_cost': scored['current_cost'][i],
+                'target_cost': scored['target_cost'][i],
+                'cost_savings': scored['cost_savings'][i],
+                'cost_savings_percent': scored['cost_savings_percent'][i]
+            }
+            latency_analysis = {
+                'current_avg_latency': avg_latency[i],
+                'target_latency': scored['target_latency'][i],
+                'latency_acceptable': scored['latency_acceptable'][i],
+                'latency_penalty': scored['latency_penalty'][i]
+            }
+            results.append({
+                'data_object_id': obj.id,
+                'current_tier': obj.current_tier,
+                'recommended_tier': recommended_tier,
+                'access_metrics': access_metrics[i],
+                'cost_analysis': cost_analysis,
+                'latency_analysis': latency_analysis,
+                'optimization_score': scored['optimization_score'][i],
+                'should_migrate': scored['should_migrate'][i],
+                # Rendered only by callers that display it (render_reasoning)
+                'reasoning_codes': self._generate_reasoning(
+                    access_metrics[i], cost_analysis, latency_analysis, recommended_tier
+                )
+            })
         
         return results
     
-    def __del__(self):
-        if hasattr(self, 'db'):
-            self.db.close()
+    def close(self):
+        """Release the calling thread's database session"""
+        db_session.remove()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
@@ -2,27 +2,41 @@
 Multi-Cloud Data Migration Service
 Handles data migration and synchronization across storage tiers and cloud providers
 """
+import math
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from sqlalchemy import and_
-from models import DataObject, Migration, SessionLocal
-from config import STORAGE_TIERS, CLOUD_PROVIDERS, MIGRATION_BATCH_SIZE, MIGRATION_MAX_CONCURRENT, MIGRATION_RETRY_ATTEMPTS
+from sqlalchemy import and_, select
+from models import DataObject, Migration, SessionLocal, db_session
+from config import (
+    STORAGE_TIERS, TIER_COST_PER_GB, CLOUD_PROVIDERS, MIGRATION_BATCH_SIZE, MIGRATION_MAX_CONCURRENT,
+    MIGRATION_RETRY_ATTEMPTS, MIGRATION_PROGRESS_CHECKPOINTS
+)
 import json
 
 class MigrationService:
     """Service for managing data migrations across storage tiers"""
     
     def __init__(self):
-        self.db = SessionLocal()
         self.active_migrations = {}
         self.migration_lock = threading.Lock()
+        self._slots = threading.Semaphore(MIGRATION_MAX_CONCURRENT)
+        self._pool = ThreadPoolExecutor(
+            max_workers=MIGRATION_MAX_CONCURRENT, thread_name_prefix='migration'
+        )
+    
+    @property
+    def db(self):
+        """Session for the calling thread (released by the app's teardown handler)"""
+        return db_session()
     
     def create_migration(self, data_object_id, target_tier, target_location=None, target_provider=None):
         """Create a new migration task"""
-        data_object = self.db.query(DataObject).filter(
-            DataObject.id == data_object_id
-        ).first()
+        data_object = self.db.execute(
+            select(DataObject.current_tier, DataObject.current_location, DataObject.size_gb)
+            .where(DataObject.id == data_object_id)
+        ).one_or_none()
         
         if not data_object:
             return None
@@ -53,11 +67,14 @@ class MigrationService:
             status='pending'
         )
         
+        # The INSERT returns the new id and column defaults are applied on
+        # flush, so the result can be built without a refresh SELECT
         self.db.add(migration)
+        self.db.flush()
+        result = migration.to_dict()
         self.db.commit()
-        self.db.refresh(migration)
         
-        return migration.to_dict()
+        return result
     
     def _determine_target_location(self, tier, provider=None):
         """Determine target location based on tier and provider"""
@@ -79,103 +96,132 @@ class MigrationService:
     
     def execute_migration(self, migration_id, simulate=True):
         """Execute a migration (simulated or real)"""
-        migration = self.db.query(Migration).filter(
-            Migration.id == migration_id
+        migration = self.db.execute(
+            select(*Migration.__table__.c).where(Migration.id == migration_id)
         ).first()
         
         if not migration:
             return None
         
         if migration.status != 'pending':
-            return migration.to_dict()
+            return Migration.serialize(migration)
         
-        # Check concurrent migration limit
-        active_count = self.db.query(Migration).filter(
-            Migration.status == 'in_progress'
-        ).count()
-        
-        if active_count >= MIGRATION_MAX_CONCURRENT:
+        # Check concurrent migration limit; taking a slot is atomic, so two
+        # requests can't both pass the check for the last one
+        if not self._slots.acquire(blocking=False):
             return {'error': 'Maximum concurrent migrations reached'}
         
-        # Start migration in background thread
-        thread = threading.Thread(
-            target=self._migrate_data,
-            args=(migration_id, simulate),
-            daemon=True
-        )
-        thread.start()
+        # Run on the shared migration pool; the task frees its slot when done
+        try:
+            self._pool.submit(self._run_migration, migration_id, simulate)
+        except Exception:
+            self._slots.release()
+            raise
         
-        return migration.to_dict()
+        return Migration.serialize(migration)
+    
+    def _run_migration(self, migration_id, simulate):
+        """Pool task: run a migration, then free its concurrency slot"""
+        try:
+            self._migrate_data(migration_id, simulate)
+        finally:
+            self._slots.release()
     
     def _migrate_data(self, migration_id, simulate=True):
         """Internal method to perform the actual migration"""
-        with self.migration_lock:
-            migration = self.db.query(Migration).filter(
-                Migration.id == migration_id
-            ).first()
-            
-            if not migration:
-                return
-            
-            migration.status = 'in_progress'
-            self.db.commit()
-            
-            data_object = self.db.query(DataObject).filter(
-                DataObject.id == migration.data_object_id
-            ).first()
-            
-            if not data_object:
-                migration.status = 'failed'
-                migration.error_message = 'Data object not found'
-                self.db.commit()
-                return
-        
-        try:
-            # Simulate migration progress
-            total_bytes = migration.total_bytes
-            bytes_transferred = 0
-            batch_size = MIGRATION_BATCH_SIZE * 1024 * 1024  # Convert MB to bytes
-            
-            # Simulate transfer in chunks
-            while bytes_transferred < total_bytes:
-                if simulate:
-                    # Simulate network transfer delay
-                    time.sleep(0.1)  # 100ms per batch
-                    bytes_transferred = min(bytes_transferred + batch_size, total_bytes)
-                else:
-                    # Real migration would call cloud APIs here
-                    # Example: boto3 for AWS, azure-storage-blob for Azure
-                    bytes_transferred = min(bytes_transferred + batch_size, total_bytes)
+        # Runs on a pool thread, so it uses its own session
+        with SessionLocal() as db:
+            with self.migration_lock:
+                migration = db.get(Migration, migration_id)
                 
-                # Update progress
-                migration.bytes_transferred = bytes_transferred
-                self.db.commit()
-            
-            # Migration complete - update data object
-            data_object.current_tier = migration.target_tier
-            data_object.current_location = migration.target_location
-            
-            # Update cost
-            tier_config = STORAGE_TIERS.get(migration.target_tier, {})
-            data_object.monthly_cost = tier_config.get('cost_per_gb', 0) * data_object.size_gb
-            
-            # Update migration status
-            migration.status = 'completed'
-            migration.completed_at = datetime.utcnow()
-            migration.bytes_transferred = total_bytes
-            
-            self.db.commit()
+                # Another task may already have picked this migration up
+                if not migration or migration.status != 'pending':
+                    return
+                
+                migration.status = 'in_progress'
+                db.commit()
+                
+                data_object = db.get(DataObject, migration.data_object_id)
+                
+                if not data_object:
+                    migration.status = 'failed'
+                    migration.error_message = 'Data object not found'
+                    db.commit()
+                    return
+                
+                # Progress is served from memory while the migration runs
+                self.active_migrations[migration_id] = migration.to_dict()
             
-        except Exception as e:
-            migration.status = 'failed'
-            migration.error_message = str(e)
-            self.db.commit()
+            try:
+                # Simulate migration progress
+                total_bytes = migration.total_bytes
+                batch_size = MIGRATION_BATCH_SIZE * 1024 * 1024  # Convert MB to bytes
+                total_batches = math.ceil(total_bytes / batch_size)
+                
+                # Progress is recorded in memory after every batch; the database
+                # is only written at a few checkpoints and at completion
+                checkpoints = min(total_batches, MIGRATION_PROGRESS_CHECKPOINTS)
+                checkpoint = 1
+                for batch in range(1, total_batches + 1):
+                    if simulate:
+                        # Simulate network transfer delay
+                        time.sleep(0.1)  # 100ms per batch
+                    else:
+                        # Real migration would call cloud APIs here
+                        # Example: boto3 for AWS, azure-storage-blob for Azure
+                        pass
+                    bytes_transferred = min(batch * batch_size, total_bytes)
+                    self._record_progress(migration_id, bytes_transferred)
+                    
+                    # Persisted only so a restart knows roughly where it stopped
+                    if checkpoint < checkpoints and batch == total_batches * checkpoint // checkpoints:
+                        migration.bytes_transferred = bytes_transferred
+                        db.commit()
+                        checkpoint += 1
+                
+                # Migration complete - update data object
+                data_object.current_tier = migration.target_tier
+                data_object.current_location = migration.target_location
+                
+                # Update cost
+                data_object.monthly_cost = TIER_COST_PER_GB.get(migration.target_tier, 0) * data_object.size_gb
+                
+                # Update migration status
+                migration.status = 'completed'
+                migration.completed_at = datetime.utcnow()
+                migration.bytes_transferred = total_bytes
+                
+                db.commit()
+                
+            except Exception as e:
+                migration.status = 'failed'
+                migration.error_message = str(e)
+                db.commit()
+            finally:
+                # Terminal state is in the database now
+                with self.migration_lock:
+                    self.active_migrations.pop(migration_id, None)
+    
+    def _record_progress(self, migration_id, bytes_transferred):
+        """Update the in-memory progress of a running migration"""
+        with self.migration_lock:
+            progress = self.active_migrations.get(migration_id)
+            if progress:
+                progress['bytes_transferred'] = bytes_transferred
+                progress['progress_percent'] = (
+                    bytes_transferred / progress['total_bytes'] * 100
+                    if progress['total_bytes'] > 0 else 0
+                )
     
     def get_migration_status(self, migration_id):
         """Get status of a migration"""
-        migration = self.db.query(Migration).filter(
-            Migration.id == migration_id
-        ).first()
+        # Running migrations report live progress without a query
+        with self.migration_lock:
+            progress = self.active_migrations.get(migration_id)
+            if progress:
+                return dict(progress)
+        
+        migration = self.db.get(Migration, migration_id)
         
         if not migration:
             return None
@@ -184,28 +230,42 @@ class MigrationService:
     
     def get_active_migrations(self):
         """Get all active migrations"""
-        migrations = self.db.query(Migration).filter(
-            Migration.status.in_(['pending', 'in_progress'])
-        ).order_by(Migration.started_at.desc()).all()
+        migrations = self.db.execute(
+            select(*Migration.__table__.c).where(
+                Migration.status.in_(['pending', 'in_progress'])
+            ).order_by(Migration.started_at.desc())
+        )
         
-        return [m.to_dict() for m in migrations]
+        results = [Migration.serialize(m) for m in migrations]
+        
+        # Live progress for migrations running in this process
+        with self.migration_lock:
+            for migration in results:
+                progress = self.active_migrations.get(migration['id'])
+                if progress:
+                    migration.update(progress)
+        
+        return results
     
-    def get_migration_history(self, data_object_id=None, limit=50):
-        """Get migration history"""
+    def get_migration_history(self, data_object_id=None, limit=50, before=None):
+        """Get migration history, newest first (`before` is the last id of the previous page)"""
         query = self.db.query(Migration)
         
         if data_object_id:
             query = query.filter(Migration.data_object_id == data_object_id)
         
-        migrations = query.order_by(Migration.started_at.desc()).limit(limit).all()
+        if before:
+            query = query.filter(Migration.id < before)
+        
+        # started_at is set on insert, so primary key order matches it and
+        # the cursor is an index seek rather than an OFFSET scan
+        migrations = query.order_by(Migration.id.desc()).limit(limit).all()
         
         return [m.to_dict() for m in migrations]
     
     def retry_failed_migration(self, migration_id):
         """Retry a failed migration"""
-        migration = self.db.query(Migration).filter(
-            Migration.id == migration_id
-        ).first()
+        migration = self.db.get(Migration, migration_id)
         
         if not migration or migration.status != 'failed':
             return None
@@ -221,13 +281,8 @@ class MigrationService:
     
     def sync_data(self, source_object_id, target_object_id):
         """Synchronize data between two objects (for multi-cloud sync)"""
-        source = self.db.query(DataObject).filter(
-            DataObject.id == source_object_id
-        ).first()
-        
-        target = self.db.query(DataObject).filter(
-            DataObject.id == target_object_id
-        ).first()
+        source = self.db.get(DataObject, source_object_id)
+        target = self.db.get(DataObject, target_object_id)
         
         if not source or not target:
             return {'error': 'Source or target object not found'}
@@ -247,9 +302,7 @@ class MigrationService:
     
     def handle_network_failure(self, migration_id):
         """Handle network failure during migration"""
-        migration = self.db.query(Migration).filter(
-            Migration.id == migration_id
-        ).first()
+        migration = self.db.get(Migration, migration_id)
         
         if not migration:
             return None
@@ -262,8 +315,14 @@ class MigrationService:
         # Auto-retry logic could be implemented here
         return migration.to_dict()
     
-    def __del__(self):
-        if hasattr(self, 'db'):
-            self.db.close()
+    def close(self):
+        """Wait for running migrations and shut down the worker pool"""
+        self._pool.shutdown()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
@@ -3,27 +3,33 @@ Machine Learning Predictor for Data Usage Patterns
 Learns from access patterns and predicts optimal data placement
 """
 import numpy as np
-import pandas as pd
 from datetime import datetime, timedelta
-from sqlalchemy import func
-from models import DataObject, AccessLog, MLPrediction, SessionLocal
-from config import STORAGE_TIERS
-import pickle
+from sqlalchemy import case, func, insert, select
+from models import DataObject, AccessLog, MLPrediction, db_session
+from access_stats import get_access_stats
+from reasoning import render_reasoning
+from config import (
+    STORAGE_TIERS, ML_EARLY_EXIT_HOT, ML_EARLY_EXIT_COLD, ML_EARLY_EXIT_CONFIDENCE
+)
+import joblib
 import os
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
+from sklearn.ensemble import HistGradientBoostingClassifier
 from sklearn.model_selection import train_test_split
 import warnings
-warnings.filterwarnings('ignore')
+
+# Tier for each class label the model is trained on (0 = hot, 1 = warm, 2 = cold)
+_TIER_LABELS = ('hot', 'warm', 'cold')
+
+# Counts, hours and costs need no more than single precision; halves the
+# size of the feature matrix for full-catalog training and batch prediction
+_FEATURE_DTYPE = np.float32
 
 class MLPredictor:
     """Machine learning predictor for data placement optimization"""
     
     def __init__(self, model_path='models/data_usage_predictor.pkl'):
-        self.db = SessionLocal()
         self.model_path = model_path
         self.model = None
-        self.scaler = StandardScaler()
         self.feature_names = [
             'size_gb',
             'access_count',
@@ -37,15 +43,25 @@ class MLPredictor:
         # Load or create model
         self._load_or_create_model()
     
+    @property
+    def db(self):
+        """Session for the calling thread (released by the app's teardown handler)"""
+        return db_session()
+    
     def _load_or_create_model(self):
         """Load existing model or create new one"""
         if os.path.exists(self.model_path):
             try:
-                with open(self.model_path, 'rb') as f:
-                    model_data = pickle.load(f)
-                    self.model = model_data['model']
-                    self.scaler = model_data['scaler']
-                    print(f"Loaded ML model from {self.model_path}")
+                # Arrays are memory-mapped rather than unpickled one by one,
+                # and shared through the page cache between workers
+                model_data = joblib.load(self.model_path, mmap_mode='r')
+                if not isinstance(model_data['model'], HistGradientBoostingClassifier):
+                    # Older random-forest bundles expect scaled features
+                    print(f"Discarding outdated ML model at {self.model_path}")
+                    self._create_model()
+                    return
+                self.model = model_data['model']
+                print(f"Loaded ML model from {self.model_path}")
             except Exception as e:
                 print(f"Error loading model: {e}, creating new model")
                 self._create_model()
@@ -54,53 +70,45 @@ class MLPredictor:
     
     def _create_model(self):
         """Create new ML model"""
-        self.model = RandomForestClassifier(
-            n_estimators=100,
-            max_depth=10,
-            random_state=42,
-            n_jobs=-1
+        # Histogram-binned boosted trees: scale-invariant, so no feature
+        # scaler, and cheaper per prediction than a 100-tree forest
+        self.model = HistGradientBoostingClassifier(
+            max_iter=100,
+            max_depth=8,
+            min_samples_leaf=5,  # Training starts from as few as 10 objects
+            random_state=42
         )
         print("Created new ML model")
     
     def extract_features(self, data_object_id):
         """Extract features for a data object"""
-        data_object = self.db.query(DataObject).filter(
-            DataObject.id == data_object_id
-        ).first()
+        data_object = self.db.execute(
+            select(DataObject.size_gb, DataObject.monthly_cost, DataObject.first_created)
+            .where(DataObject.id == data_object_id)
+        ).one_or_none()
         
         if not data_object:
             return None
         
-        # Calculate access metrics
-        cutoff_date = datetime.utcnow() - timedelta(days=30)
-        access_count = self.db.query(func.count(AccessLog.id)).filter(
-            AccessLog.data_object_id == data_object_id,
-            AccessLog.accessed_at >= cutoff_date
-        ).scalar() or 0
+        # Access count (last 30 days), last access time and average latency
+        access_count, last_access, avg_latency = get_access_stats(self.db, data_object_id)
         
         accesses_per_day = access_count / 30.0 if access_count > 0 else 0
         
-        # Get last access time
-        last_access = self.db.query(func.max(AccessLog.accessed_at)).filter(
-            AccessLog.data_object_id == data_object_id
-        ).scalar()
-        
+        now = datetime.utcnow()
         if last_access:
-            hours_since_access = (datetime.utcnow() - last_access).total_seconds() / 3600
+            hours_since_access = (now - last_access).total_seconds() / 3600
         else:
-            hours_since_access = (datetime.utcnow() - data_object.first_created).total_seconds() / 3600
+            hours_since_access = (now - data_object.first_created).total_seconds() / 3600
         
-        # Calculate average latency
-        avg_latency = self.db.query(func.avg(AccessLog.latency_ms)).filter(
-            AccessLog.data_object_id == data_object_id,
-            AccessLog.latency_ms.isnot(None)
-        ).scalar() or 100.0  # Default
+        # Average latency
+        avg_latency = avg_latency or 100.0  # Default
         
         # Current cost
         current_cost = data_object.monthly_cost
         
         # Days since creation
-        days_since_creation = (datetime.utcnow() - data_object.first_created).total_seconds() / 86400
+        days_since_creation = (now - data_object.first_created).total_seconds() / 86400
         
         features = np.array([[
             data_object.size_gb,
@@ -110,7 +118,7 @@ class MLPredictor:
             avg_latency,
             current_cost,
             days_since_creation
-        ]])
+        ]], dtype=_FEATURE_DTYPE)
         
         return features
     
@@ -121,174 +129,249 @@ class MLPredictor:
         if features is None:
             return None
         
-        # Scale features
-        features_scaled = self.scaler.transform(features)
+        result, prediction = self._build_prediction(
+            data_object_id, features, self._tier_scores(features)[0]
+        )
         
-        # Predict
-        tier_prediction = self.model.predict(features_scaled)[0]
-        confidence_scores = self.model.predict_proba(features_scaled)[0]
+        # Store prediction
+        self.db.add(MLPrediction(**prediction))
+        self.db.commit()
         
+        return result
+    
+    def _tier_scores(self, features):
+        """Class probabilities for each feature row, as columns hot, warm, cold"""
+        scores = np.zeros((len(features), len(_TIER_LABELS)))
+        
+        # Clear-cut objects (well inside the hot/cold training labels) skip
+        # the model; only the ambiguous rows pay for predict_proba
+        accesses_per_day = features[:, self.feature_names.index('accesses_per_day')]
+        hours_since_access = features[:, self.feature_names.index('hours_since_access')]
+        is_hot = ((accesses_per_day >= ML_EARLY_EXIT_HOT['accesses_per_day']) &
+                  (hours_since_access < ML_EARLY_EXIT_HOT['max_hours_since_access']))
+        is_cold = ((accesses_per_day < ML_EARLY_EXIT_COLD['accesses_per_day']) &
+                   (hours_since_access > ML_EARLY_EXIT_COLD['min_hours_since_access']))
+        other = (1 - ML_EARLY_EXIT_CONFIDENCE) / (len(_TIER_LABELS) - 1)
+        for mask, tier in ((is_hot, 0), (is_cold, 2)):
+            scores[mask] = other
+            scores[mask, tier] = ML_EARLY_EXIT_CONFIDENCE
+        
+        ambiguous = ~(is_hot | is_cold)
+        if not ambiguous.any():
+            return scores
+        
+        classes = self.model.classes_.astype(int)
+        
+        # Trained on a single tier (e.g. a fresh catalog that is all cold):
+        # that tier is certain, and predict_proba's shape isn't meaningful
+        if len(classes) == 1:
+            scores[ambiguous, classes[0]] = 1.0
+            return scores
+        
+        # The model only has columns for classes seen in training
+        model_scores = np.zeros((int(ambiguous.sum()), len(_TIER_LABELS)))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            model_scores[:, classes] = self.model.predict_proba(features[ambiguous])
+        scores[ambiguous] = model_scores
+        return scores
+    
+    def _build_prediction(self, data_object_id, features, confidence_scores):
+        """Build the API result and MLPrediction column values for one object's scores"""
         # Map prediction to tier
-        tier_map = {0: 'hot', 1: 'warm', 2: 'cold'}
-        predicted_tier = tier_map.get(tier_prediction, 'warm')
-        
-        # Get confidence score
-        tier_indices = {'hot': 0, 'warm': 1, 'cold': 2}
-        confidence = confidence_scores[tier_indices[predicted_tier]]
-        
-        # Generate reasoning
-        reasoning = self._generate_reasoning(features[0], predicted_tier, confidence)
+        tier_prediction = int(np.argmax(confidence_scores))
+        predicted_tier = _TIER_LABELS[tier_prediction]
+        confidence = float(confidence_scores[tier_prediction])
         
-        # Store prediction
-        prediction = MLPrediction(
-            data_object_id=data_object_id,
-            predicted_tier=predicted_tier,
-            confidence_score=float(confidence),
-            reasoning=reasoning
-        )
+        # Stored as text, so rendered here rather than left to the caller
+        reasoning = render_reasoning(self._generate_reasoning(features, predicted_tier, confidence))
         
-        self.db.add(prediction)
-        self.db.commit()
+        prediction = {
+            'data_object_id': data_object_id,
+            'predicted_tier': predicted_tier,
+            'confidence_score': confidence,
+            'reasoning': reasoning
+        }
         
-        return {
+        result = {
             'data_object_id': data_object_id,
             'predicted_tier': predicted_tier,
-            'confidence_score': float(confidence),
+            'confidence_score': confidence,
             'reasoning': reasoning,
             'all_scores': {
-                'hot': float(confidence_scores[0]),
-                'warm': float(confidence_scores[1]),
-                'cold': float(confidence_scores[2])
+                tier: float(score) for tier, score in zip(_TIER_LABELS, confidence_scores)
             }
         }
+        
+        return result, prediction
     
     def _generate_reasoning(self, features, tier, confidence):
-        """Generate human-readable reasoning for prediction"""
-        size_gb, access_count, accesses_per_day, hours_since_access, avg_latency, current_cost, days_since_creation = features[0]
+        """Reason codes for a prediction (see reasoning.render_reasoning)"""
+        accesses_per_day = features[0][self.feature_names.index('accesses_per_day')]
+        hours_since_access = features[0][self.feature_names.index('hours_since_access')]
         
         reasons = []
         
         if accesses_per_day > 50:
-            reasons.append(f"Very high access frequency ({accesses_per_day:.1f}/day)")
+            reasons.append(('ML_VERY_HIGH_ACCESS', accesses_per_day))
         elif accesses_per_day > 10:
-            reasons.append(f"High access frequency ({accesses_per_day:.1f}/day)")
+            reasons.append(('ML_HIGH_ACCESS', accesses_per_day))
         elif accesses_per_day > 1:
-            reasons.append(f"Moderate access frequency ({accesses_per_day:.1f}/day)")
+            reasons.append(('ML_MODERATE_ACCESS', accesses_per_day))
         else:
-            reasons.append(f"Low access frequency ({accesses_per_day:.1f}/day)")
+            reasons.append(('ML_LOW_ACCESS', accesses_per_day))
         
         if hours_since_access < 24:
-            reasons.append("Recently accessed")
+            reasons.append(('RECENTLY_ACCESSED',))
         elif hours_since_access < 168:
-            reasons.append("Accessed within last week")
+            reasons.append(('ACCESSED_THIS_WEEK',))
         else:
-            reasons.append("Not accessed recently")
+            reasons.append(('NOT_RECENTLY_ACCESSED',))
         
         if tier == 'hot':
-            reasons.append("Recommended for hot tier due to high access")
+            reasons.append(('RECOMMEND_HOT',))
         elif tier == 'warm':
-            reasons.append("Recommended for warm tier for balanced performance/cost")
+            reasons.append(('RECOMMEND_WARM',))
         else:
-            reasons.append("Recommended for cold tier due to low access")
+            reasons.append(('RECOMMEND_COLD',))
         
-        reasons.append(f"Confidence: {confidence:.1%}")
+        reasons.append(('CONFIDENCE', confidence))
         
-        return "; ".join(reasons)
+        return tuple(reasons)
     
     def train_model(self):
         """Train the ML model on historical data"""
         print("Training ML model...")
         
-        # Get all data objects with access logs
-        data_objects = self.db.query(DataObject).all()
+        # Features for every data object in one pass
+        ids, X = self.batch_features(limit=None)
         
-        if len(data_objects) < 10:
+        if len(ids) < 10:
             print("Not enough data for training, using default model")
             return
         
-        X = []
-        y = []
-        
-        for obj in data_objects:
-            features = self.extract_features(obj.id)
-            if features is None:
-                continue
-            
-            # Determine actual tier based on access patterns
-            access_count = self.db.query(func.count(AccessLog.id)).filter(
-                AccessLog.data_object_id == obj.id
-            ).scalar() or 0
-            
-            last_access = self.db.query(func.max(AccessLog.accessed_at)).filter(
-                AccessLog.data_object_id == obj.id
-            ).scalar()
-            
-            if last_access:
-                hours_since = (datetime.utcnow() - last_access).total_seconds() / 3600
-            else:
-                hours_since = (datetime.utcnow() - obj.first_created).total_seconds() / 3600
-            
-            # Label based on access patterns
-            if access_count > 100 and hours_since < 24:
-                label = 0  # hot
-            elif access_count > 10 and hours_since < 168:
-                label = 1  # warm
-            else:
-                label = 2  # cold
-            
-            X.append(features[0])
-            y.append(label)
-        
-        if len(X) < 10:
-            print("Not enough labeled data for training")
-            return
-        
-        X = np.array(X)
-        y = np.array(y)
+        # Determine actual tier based on access patterns: all-time access
+        # count, and the same hours-since-access as the feature
+        total_accesses = dict(self.db.execute(
+            select(AccessLog.data_object_id, func.count(AccessLog.id))
+            .group_by(AccessLog.data_object_id)
+        ).all())
+        access_count = np.array([total_accesses.get(i, 0) for i in ids.tolist()])
+        hours_since = X[:, self.feature_names.index('hours_since_access')]
+        
+        # Label based on access patterns: 0 = hot, 1 = warm, 2 = cold
+        y = np.where(
+            (access_count > 100) & (hours_since < 24), 0,
+            np.where((access_count > 10) & (hours_since < 168), 1, 2)
+        )
         
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(
             X, y, test_size=0.2, random_state=42
         )
         
-        # Scale features
-        X_train_scaled = self.scaler.fit_transform(X_train)
-        X_test_scaled = self.scaler.transform(X_test)
-        
-        # Train model
-        self.model.fit(X_train_scaled, y_train)
-        
-        # Evaluate
-        train_score = self.model.score(X_train_scaled, y_train)
-        test_score = self.model.score(X_test_scaled, y_test)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            
+            # Train model
+            self.model.fit(X_train, y_train)
+            
+            # Evaluate
+            train_score = self.model.score(X_train, y_train)
+            test_score = self.model.score(X_test, y_test)
         
         print(f"Model training complete - Train accuracy: {train_score:.2%}, Test accuracy: {test_score:.2%}")
         
         # Save model
+        # Uncompressed so it can be memory-mapped on load; written aside and
+        # renamed so processes mapping the old file keep a valid copy
         os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
-        with open(self.model_path, 'wb') as f:
-            pickle.dump({
-                'model': self.model,
-                'scaler': self.scaler,
-                'feature_names': self.feature_names
-            }, f)
+        tmp_path = f"{self.model_path}.tmp"
+        joblib.dump({
+            'model': self.model,
+            'feature_names': self.feature_names
+        }, tmp_path)
+        os.replace(tmp_path, self.model_path)
         
         print(f"Model saved to {self.model_path}")
     
+    def batch_features(self, limit=100):
+        """Feature matrix for up to `limit` data objects, from two queries"""
+        # Imported here so only batch callers pay pandas' import time and memory
+        import pandas as pd
+        
+        connection = self.db.connection()
+        objects = pd.read_sql(
+            select(
+                DataObject.id, DataObject.size_gb, DataObject.monthly_cost,
+                DataObject.first_created
+            ).limit(limit),
+            connection
+        )
+        if objects.empty:
+            return objects['id'].to_numpy(), np.empty((0, len(self.feature_names)), dtype=_FEATURE_DTYPE)
+        
+        # Same windows as extract_features: only the count is limited to 30 days
+        cutoff_date = datetime.utcnow() - timedelta(days=30)
+        access = pd.read_sql(
+            select(
+                AccessLog.data_object_id.label('id'),
+                func.count(case((AccessLog.accessed_at >= cutoff_date, AccessLog.id))).label('access_count'),
+                func.max(AccessLog.accessed_at).label('last_access'),
+                func.avg(AccessLog.latency_ms).label('avg_latency_ms')
+            ).where(
+                AccessLog.data_object_id.in_(objects['id'].tolist())
+            ).group_by(AccessLog.data_object_id),
+            connection
+        )
+        
+        df = objects.merge(access, on='id', how='left')
+        now = pd.Timestamp(datetime.utcnow())
+        first_created = pd.to_datetime(df['first_created'])
+        last_access = pd.to_datetime(df['last_access']).fillna(first_created)
+        
+        df['access_count'] = df['access_count'].fillna(0)
+        df['accesses_per_day'] = df['access_count'] / 30.0
+        df['hours_since_access'] = (now - last_access).dt.total_seconds() / 3600
+        # NULL or zero average latency falls back to the default, as in extract_features
+        df['avg_latency_ms'] = df['avg_latency_ms'].fillna(0).replace(0, 100.0)
+        df['current_cost'] = df['monthly_cost']
+        df['days_since_creation'] = (now - first_created).dt.total_seconds() / 86400
+        
+        return df['id'].to_numpy(), df[self.feature_names].to_numpy(dtype=_FEATURE_DTYPE)
+    
     def batch_predict(self, limit=100):
         """Predict tiers for multiple data objects"""
-        data_objects = self.db.query(DataObject).limit(limit).all()
-        predictions = []
+        ids, features = self.batch_features(limit)
+        if len(ids) == 0:
+            return []
         
-        for obj in data_objects:
-            prediction = self.predict_tier(obj.id)
-            if prediction:
-                predictions.append(prediction)
+        # One model call for the whole batch
+        scores = self._tier_scores(features)
+        
+        predictions = []
+        rows = []
+        for i, data_object_id in enumerate(ids.tolist()):
+            result, prediction = self._build_prediction(
+                data_object_id, features[i:i + 1], scores[i]
+            )
+            predictions.append(result)
+            rows.append(prediction)
+        
+        # One executemany INSERT instead of per-object unit-of-work bookkeeping
+        self.db.execute(insert(MLPrediction), rows)
+        self.db.commit()
         
         return predictions
     
-    def __del__(self):
-        if hasattr(self, 'db'):
-            self.db.close()
+    def close(self):
+        """Release the calling thread's database session"""
+        db_session.remove()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
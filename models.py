@@ -1,11 +1,17 @@
 """
 Database models for the Intelligent Data Management System
 """
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Text, JSON, ForeignKey, Index, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, scoped_session
 from datetime import datetime
-from config import DATABASE_URL
+import orjson
+from config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE_SECONDS, DB_QUERY_CACHE_SIZE,
+    DB_EXECUTEMANY_PAGE_SIZE
+)
 
 Base = declarative_base()
 
@@ -38,6 +44,17 @@ class DataObject(Base):
     access_logs = relationship("AccessLog", back_populates="data_object", cascade="all, delete-orphan")
     migrations = relationship("Migration", back_populates="data_object", cascade="all, delete-orphan")
     
+    __table_args__ = (
+        Index('ix_data_object_current_tier', 'current_tier'),
+    )
+    
+    # Columns exposed by to_dict, in order (also used to serialize plain rows)
+    SERIALIZED_COLUMNS = (
+        'id', 'name', 'size_gb', 'current_tier', 'current_location', 'cloud_provider',
+        'region', 'access_count', 'last_accessed', 'first_created', 'monthly_cost',
+        'content_type', 'encrypted'
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -48,8 +65,8 @@ class DataObject(Base):
             'cloud_provider': self.cloud_provider,
             'region': self.region,
             'access_count': self.access_count,
-            'last_accessed': self.last_accessed.isoformat() if self.last_accessed else None,
-            'first_created': self.first_created.isoformat() if self.first_created else None,
+            'last_accessed': self.last_accessed,
+            'first_created': self.first_created,
             'monthly_cost': self.monthly_cost,
             'content_type': self.content_type,
             'encrypted': self.encrypted
@@ -61,18 +78,27 @@ class AccessLog(Base):
     
     id = Column(Integer, primary_key=True)
     data_object_id = Column(Integer, ForeignKey('data_objects.id'), nullable=False)
-    accessed_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Python default for the app's inserts (which pass one time per batch);
+    # the server default covers rows written by other clients
+    accessed_at = Column(DateTime, default=datetime.utcnow, server_default=func.now(), nullable=False)
     access_type = Column(String(50))  # read, write, delete
     latency_ms = Column(Float)
     source_ip = Column(String(50))
     
     data_object = relationship("DataObject", back_populates="access_logs")
     
+    __table_args__ = (
+        Index('ix_access_accessed_at', 'accessed_at'),
+        # Per-object count/max over a time window, and avg latency, from the index alone
+        Index('ix_accesslog_obj_time', 'data_object_id', 'accessed_at'),
+        Index('ix_accesslog_obj_lat', 'data_object_id', 'latency_ms'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
             'data_object_id': self.data_object_id,
-            'accessed_at': self.accessed_at.isoformat(),
+            'accessed_at': self.accessed_at,
             'access_type': self.access_type,
             'latency_ms': self.latency_ms,
             'source_ip': self.source_ip
@@ -98,21 +124,36 @@ class Migration(Base):
     
     data_object = relationship("DataObject", back_populates="migrations")
     
+    __table_args__ = (
+        Index('ix_migration_obj_status_started', 'data_object_id', 'status', 'started_at'),
+        # Partial index: only pending/in-progress rows, so it stays tiny
+        Index(
+            'ix_migration_active_status', 'status',
+            sqlite_where=text("status IN ('pending', 'in_progress')"),
+            postgresql_where=text("status IN ('pending', 'in_progress')")
+        ),
+    )
+    
     def to_dict(self):
+        return Migration.serialize(self)
+    
+    @staticmethod
+    def serialize(row):
+        """to_dict for a Migration instance or a plain row of its columns"""
         return {
-            'id': self.id,
-            'data_object_id': self.data_object_id,
-            'source_tier': self.source_tier,
-            'target_tier': self.target_tier,
-            'source_location': self.source_location,
-            'target_location': self.target_location,
-            'status': self.status,
-            'started_at': self.started_at.isoformat(),
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
-            'bytes_transferred': self.bytes_transferred,
-            'total_bytes': self.total_bytes,
-            'progress_percent': (self.bytes_transferred / self.total_bytes * 100) if self.total_bytes > 0 else 0,
-            'error_message': self.error_message
+            'id': row.id,
+            'data_object_id': row.data_object_id,
+            'source_tier': row.source_tier,
+            'target_tier': row.target_tier,
+            'source_location': row.source_location,
+            'target_location': row.target_location,
+            'status': row.status,
+            'started_at': row.started_at,
+            'completed_at': row.completed_at,
+            'bytes_transferred': row.bytes_transferred,
+            'total_bytes': row.total_bytes,
+            'progress_percent': (row.bytes_transferred / row.total_bytes * 100) if row.total_bytes > 0 else 0,
+            'error_message': row.error_message
         }
 
 class StreamingEvent(Base):
@@ -122,18 +163,28 @@ class StreamingEvent(Base):
     id = Column(Integer, primary_key=True)
     event_type = Column(String(100), nullable=False)  # data_ingestion, access_pattern, alert
     data_object_id = Column(Integer, ForeignKey('data_objects.id'))
-    payload = Column(Text)  # JSON string
-    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
+    payload = Column(JSON().with_variant(JSONB(), 'postgresql'))  # Event as received
+    timestamp = Column(DateTime, default=datetime.utcnow, server_default=func.now(), nullable=False)
     processed = Column(Boolean, default=False)
     
+    __table_args__ = (
+        # Time-range reads over the event stream (recent activity, retention)
+        Index('ix_streaming_event_timestamp', 'timestamp'),
+    )
+    
     def to_dict(self):
+        return StreamingEvent.serialize(self)
+    
+    @staticmethod
+    def serialize(row):
+        """to_dict for a StreamingEvent instance or a plain row of its columns"""
         return {
-            'id': self.id,
-            'event_type': self.event_type,
-            'data_object_id': self.data_object_id,
-            'payload': self.payload,
-            'timestamp': self.timestamp.isoformat(),
-            'processed': self.processed
+            'id': row.id,
+            'event_type': row.event_type,
+            'data_object_id': row.data_object_id,
+            'payload': row.payload,
+            'timestamp': row.timestamp,
+            'processed': row.processed
         }
 
 class MLPrediction(Base):
@@ -153,17 +204,52 @@ class MLPrediction(Base):
             'data_object_id': self.data_object_id,
             'predicted_tier': self.predicted_tier,
             'confidence_score': self.confidence_score,
-            'predicted_at': self.predicted_at.isoformat(),
+            'predicted_at': self.predicted_at,
             'reasoning': self.reasoning
         }
 
 # Database setup
-engine = create_engine(DATABASE_URL, echo=False)
+def _engine_options(url):
+    """Connection pool and bulk-write settings for the configured database"""
+    options = {'insertmanyvalues_page_size': DB_EXECUTEMANY_PAGE_SIZE}
+    
+    # psycopg2 otherwise sends executemany UPDATEs (access counts, ingestion
+    # metadata) one statement per row; batch them per round-trip instead
+    if make_url(url).get_dialect().driver == 'psycopg2':
+        options['executemany_mode'] = 'values_plus_batch'
+        options['executemany_batch_page_size'] = DB_EXECUTEMANY_PAGE_SIZE
+    
+    # In-memory SQLite keeps its single-connection pool
+    if url.startswith('sqlite') and (url == 'sqlite://' or ':memory:' in url):
+        return options
+    return {
+        **options,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_recycle': DB_POOL_RECYCLE_SECONDS,
+        'pool_pre_ping': True
+    }
+
+engine = create_engine(
+    DATABASE_URL, echo=False, query_cache_size=DB_QUERY_CACHE_SIZE,
+    # JSON columns are encoded once, by orjson, on the way to the database
+    json_serializer=lambda obj: orjson.dumps(obj).decode(),
+    json_deserializer=orjson.loads,
+    **_engine_options(DATABASE_URL)
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Thread-local session for request handlers; released on app context teardown
+db_session = scoped_session(SessionLocal)
+
 def init_db():
     """Initialize the database with all tables"""
     Base.metadata.create_all(bind=engine)
+    
+    # create_all skips existing tables, so add indexes introduced since
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 def get_db():
     """Get database session"""
@@ -0,0 +1,35 @@
+"""
+Recommendation Reasoning
+Compact reason codes for placement and prediction results, rendered to text on demand
+"""
+
+# Code -> text template; a reason is (code, *template arguments)
+REASONING_TEMPLATES = {
+    # Placement optimizer
+    'HIGH_ACCESS': "High access frequency ({:.1f} accesses/day)",
+    'MODERATE_ACCESS': "Moderate access frequency ({:.1f} accesses/day)",
+    'LOW_ACCESS': "Low access frequency ({:.1f} accesses/day)",
+    'COST_SAVINGS': "Cost savings: ${:.2f}/month ({:.1f}%)",
+    'LATENCY_OK': "Latency acceptable: {}ms",
+    'LATENCY_CONCERN': "Latency concern: {}ms may be too high",
+    
+    # ML predictor
+    'ML_VERY_HIGH_ACCESS': "Very high access frequency ({:.1f}/day)",
+    'ML_HIGH_ACCESS': "High access frequency ({:.1f}/day)",
+    'ML_MODERATE_ACCESS': "Moderate access frequency ({:.1f}/day)",
+    'ML_LOW_ACCESS': "Low access frequency ({:.1f}/day)",
+    'RECENTLY_ACCESSED': "Recently accessed",
+    'ACCESSED_THIS_WEEK': "Accessed within last week",
+    'NOT_RECENTLY_ACCESSED': "Not accessed recently",
+    'RECOMMEND_HOT': "Recommended for hot tier due to high access",
+    'RECOMMEND_WARM': "Recommended for warm tier for balanced performance/cost",
+    'RECOMMEND_COLD': "Recommended for cold tier due to low access",
+    'CONFIDENCE': "Confidence: {:.1%}"
+}
+
+def render_reasoning(codes):
+    """Human-readable reasoning for a sequence of (code, *args) reasons"""
+    return "; ".join(
+        REASONING_TEMPLATES[code].format(*args) for code, *args in codes
+    )
+
@@ -8,8 +8,9 @@ import sys
 # Add current directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from models import init_db
+# app goes first: in eventlet mode it monkey-patches before other imports
 from app import app, socketio
+from models import init_db
 from config import API_HOST, API_PORT, DEBUG
 
 if __name__ == '__main__':
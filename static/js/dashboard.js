@@ -17,7 +17,9 @@ function initSocket() {
         loadStats();
     });
     
-    socket.on('access_logged', (data) => {
+    // Access events arrive batched; one refresh covers the whole batch
+    socket.on('access_logged_batch', (accesses) => {
+        if (accesses.length === 0) return;
         loadDataObjects();
         loadStats();
     });
@@ -309,7 +311,7 @@ async function createSampleData() {
     
     for (const obj of sampleObjects) {
         try {
-            await fetch(`${API_BASE}/data-objects`, {
+            const objResponse = await fetch(`${API_BASE}/data-objects`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -318,9 +320,7 @@ async function createSampleData() {
             });
             
             // Simulate some access logs
-            const objResponse = await fetch(`${API_BASE}/data-objects`);
-            const objects = await objResponse.json();
-            const createdObj = objects.find(o => o.name === obj.name);
+            const createdObj = objResponse.ok ? await objResponse.json() : null;
             
             if (createdObj) {
                 for (let i = 0; i < Math.floor(Math.random() * 20) + 5; i++) {
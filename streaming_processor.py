@@ -2,33 +2,81 @@
 Real-Time Data Streaming Processor
 Handles continuous data flow using Kafka or MQTT
 """
-import json
+import importlib.util
 import threading
 import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import numpy as np
+import orjson
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.orm import scoped_session
 from models import StreamingEvent, DataObject, AccessLog, SessionLocal
-from config import MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, KAFKA_BOOTSTRAP_SERVERS
+from access_stats import invalidate_access_stats
+from config import (
+    MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, KAFKA_BOOTSTRAP_SERVERS, KAFKA_GROUP_ID,
+    STREAMING_RECENT_EVENTS, KAFKA_MAX_POLL_RECORDS, KAFKA_POLL_TIMEOUT_MS, KAFKA_FETCH_MIN_BYTES,
+    KAFKA_FETCH_MAX_WAIT_MS, KAFKA_MAX_PARTITION_FETCH_BYTES, KAFKA_PRODUCER_LINGER_MS,
+    KAFKA_PRODUCER_BATCH_SIZE, KAFKA_COMPRESSION_TYPE,
+    STREAMING_ACCESS_FLUSH_INTERVAL_SECONDS, STREAMING_ACCESS_FLUSH_MAX_PENDING,
+    STREAMING_HANDLER_WORKERS, STREAMING_HANDLER_MAX_PENDING
+)
 import random
 
-try:
-    from kafka import KafkaConsumer, KafkaProducer
-    KAFKA_AVAILABLE = True
-except ImportError:
-    KAFKA_AVAILABLE = False
+def _module_available(name):
+    """Whether a module can be imported, without importing it"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
+# The client libraries are imported when a consumer/subscriber starts, so
+# processes that only simulate streams don't pay for loading them
+KAFKA_AVAILABLE = _module_available('kafka')
+if not KAFKA_AVAILABLE:
     print("Warning: kafka-python not available, using simulation mode")
 
-try:
-    import paho.mqtt.client as mqtt
-    MQTT_AVAILABLE = True
-except ImportError:
-    MQTT_AVAILABLE = False
+MQTT_AVAILABLE = _module_available('paho.mqtt.client')
+if not MQTT_AVAILABLE:
     print("Warning: paho-mqtt not available, using simulation mode")
 
+# Batch write statements, built once; their compiled SQL is reused from the
+# engine's statement cache on every batch
+_INSERT_STREAMING_EVENTS = insert(StreamingEvent).returning(
+    *StreamingEvent.__table__.c, sort_by_parameter_order=True
+)
+_INSERT_ACCESS_LOGS = insert(AccessLog)
+# SET columns come from the parameter keys (size_gb, content_type)
+_UPDATE_OBJECT_METADATA = (
+    update(DataObject.__table__)
+    .where(DataObject.__table__.c.id == bindparam('object_id'))
+)
+_ADD_ACCESS_COUNTS = (
+    update(DataObject.__table__)
+    .where(DataObject.__table__.c.id == bindparam('object_id'))
+    .values(
+        access_count=DataObject.__table__.c.access_count + bindparam('count'),
+        last_accessed=bindparam('last_accessed')
+    )
+)
+
+# Simulated event fields, drawn a whole batch at a time in simulate_data_stream_batch
+_RNG = np.random.default_rng()
+_SIMULATED_EVENT_TYPES = ['data_ingestion', 'access_event', 'alert']
+_SIMULATED_CONTENT_TYPES = ['image', 'video', 'document', 'database']
+_SIMULATED_ACCESS_TYPES = ['read', 'write', 'delete']
+_SIMULATED_ALERT_TYPES = ['cost_threshold', 'latency_spike', 'capacity_warning']
+_SIMULATED_ALERT_MESSAGES = ['High cost detected', 'Latency spike', 'Capacity warning']
+
 class StreamingProcessor:
     """Processes real-time data streams"""
     
     def __init__(self, use_kafka=True, use_mqtt=False):
-        self.db = SessionLocal()
+        # Session per thread (Kafka, MQTT and simulation loops run
+        # concurrently), checked out for one batch at a time so no pooled
+        # connection is held between batches
+        self._sessions = scoped_session(SessionLocal)
         self.use_kafka = use_kafka and KAFKA_AVAILABLE
         self.use_mqtt = use_mqtt and MQTT_AVAILABLE
         self.running = False
@@ -36,6 +84,35 @@ class StreamingProcessor:
         self.producer = None
         self.mqtt_client = None
         self.event_handlers = []
+        # Custom handlers run on a pool so a slow one doesn't stall ingestion;
+        # the semaphore bounds queued work and pushes back when it's full
+        self._handler_pool = ThreadPoolExecutor(
+            max_workers=STREAMING_HANDLER_WORKERS, thread_name_prefix='stream-handler'
+        )
+        self._handler_slots = threading.BoundedSemaphore(STREAMING_HANDLER_MAX_PENDING)
+        # Newest events as stored (to_dict form), oldest first
+        self.recent = deque(maxlen=STREAMING_RECENT_EVENTS)
+        # Access counts not yet added to data_objects, coalesced per object
+        self._access_counter = Counter()
+        self._last_access_ts = {}
+        self._pending_accesses = 0
+        self._access_flushed_at = time.monotonic()
+        self._access_lock = threading.Lock()
+        # Flushes counts on a timer too, so they land even when no more events arrive
+        self._closed = threading.Event()
+        threading.Thread(target=self._access_flush_loop, daemon=True).start()
+        # Event type -> built-in handler, each called as handler(event_data, batch)
+        self._dispatch = {
+            'data_ingestion': self._handle_data_ingestion,
+            'access_event': self._handle_access_event,
+            'migration_event': self._handle_migration_event,
+            'alert': self._handle_alert
+        }
+    
+    @property
+    def db(self):
+        """Session for the calling thread's current batch"""
+        return self._sessions()
     
     def start_kafka_consumer(self):
         """Start Kafka consumer for real-time data processing"""
@@ -43,19 +120,31 @@ class StreamingProcessor:
             return False
         
         try:
+            from kafka import KafkaConsumer, KafkaProducer
+            
             self.consumer = KafkaConsumer(
                 'data-stream',
                 'access-events',
                 'migration-events',
                 bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-                value_deserializer=lambda m: json.loads(m.decode('utf-8')),
+                value_deserializer=orjson.loads,
                 auto_offset_reset='latest',
-                enable_auto_commit=True
+                # Offsets are committed to this group after each batch is stored
+                group_id=KAFKA_GROUP_ID,
+                enable_auto_commit=False,
+                max_poll_records=KAFKA_MAX_POLL_RECORDS,
+                fetch_min_bytes=KAFKA_FETCH_MIN_BYTES,
+                fetch_max_wait_ms=KAFKA_FETCH_MAX_WAIT_MS,
+                max_partition_fetch_bytes=KAFKA_MAX_PARTITION_FETCH_BYTES
             )
             
             self.producer = KafkaProducer(
                 bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-                value_serializer=lambda v: json.dumps(v).encode('utf-8')
+                value_serializer=orjson.dumps,
+                linger_ms=KAFKA_PRODUCER_LINGER_MS,
+                batch_size=KAFKA_PRODUCER_BATCH_SIZE,
+                compression_type=KAFKA_COMPRESSION_TYPE,
+                acks=1
             )
             
             self.running = True
@@ -73,6 +162,8 @@ class StreamingProcessor:
             return False
         
         try:
+            import paho.mqtt.client as mqtt
+            
             self.mqtt_client = mqtt.Client()
             self.mqtt_client.on_connect = self._on_mqtt_connect
             self.mqtt_client.on_message = self._on_mqtt_message
@@ -80,8 +171,9 @@ class StreamingProcessor:
             self.mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
             self.running = True
             
-            thread = threading.Thread(target=self._mqtt_loop, daemon=True)
-            thread.start()
+            # paho's own network thread handles reads, writes and reconnects,
+            # so publishes don't wait on a blocking loop
+            self.mqtt_client.loop_start()
             
             return True
         except Exception as e:
@@ -99,112 +191,258 @@ class StreamingProcessor:
     def _on_mqtt_message(self, client, userdata, msg):
         """MQTT message callback"""
         try:
-            payload = json.loads(msg.payload.decode('utf-8'))
-            self._process_streaming_event(payload)
+            payload = orjson.loads(msg.payload)
+            self._process_payload(payload)
         except Exception as e:
             print(f"Error processing MQTT message: {e}")
     
-    def _mqtt_loop(self):
-        """MQTT event loop"""
-        self.mqtt_client.loop_forever()
-    
     def _kafka_consume_loop(self):
         """Kafka consumer loop"""
+        # Set after a batch failed once and was rewound for redelivery
+        retrying = False
         while self.running:
             try:
-                message_pack = self.consumer.poll(timeout_ms=1000)
-                for topic_partition, messages in message_pack.items():
-                    for message in messages:
-                        self._process_streaming_event(message.value)
+                message_pack = self.consumer.poll(
+                    timeout_ms=KAFKA_POLL_TIMEOUT_MS, max_records=KAFKA_MAX_POLL_RECORDS
+                )
             except Exception as e:
                 print(f"Error in Kafka consumer loop: {e}")
                 time.sleep(1)
+                continue
+            
+            if not message_pack:
+                self._flush_access_counts()
+                continue
+            
+            events = []
+            for topic_partition, messages in message_pack.items():
+                for message in messages:
+                    payload = message.value
+                    events.extend(payload if isinstance(payload, list) else [payload])
+            
+            # One transaction for the whole poll, then one offset commit
+            try:
+                self._process_events(events)
+                retrying = False
+            except Exception as e:
+                if not retrying:
+                    # Redeliver the batch once, in case the failure was transient
+                    print(f"Error storing Kafka batch, retrying: {e}")
+                    retrying = True
+                    self._rewind_consumer(message_pack)
+                    time.sleep(1)
+                    continue
+                
+                # Failed again: store what can be stored and skip the rest
+                print(f"Error storing Kafka batch again, processing events one at a time: {e}")
+                retrying = False
+                self._process_events_individually(events)
+            
+            try:
+                self.consumer.commit()
+            except Exception as e:
+                print(f"Error committing Kafka offsets: {e}")
+    
+    def _rewind_consumer(self, message_pack):
+        """Seek polled partitions back to their committed offsets so a failed batch is redelivered"""
+        for topic_partition, messages in message_pack.items():
+            try:
+                committed = self.consumer.committed(topic_partition)
+                self.consumer.seek(
+                    topic_partition, committed if committed is not None else messages[0].offset
+                )
+            except Exception as e:
+                print(f"Error rewinding Kafka partition {topic_partition}: {e}")
+    
+    def _process_events_individually(self, events):
+        """Store events one transaction each, logging and skipping any that fail"""
+        for event_data in events:
+            try:
+                self._process_events([event_data])
+            except Exception as e:
+                print(f"Skipping streaming event that could not be stored: {e}")
+    
+    def _process_payload(self, payload):
+        """Process a message holding one event or a batch from publish_events"""
+        self._process_events(payload if isinstance(payload, list) else [payload])
     
     def _process_streaming_event(self, event_data):
         """Process a streaming event"""
-        event_type = event_data.get('type', 'unknown')
+        self._process_events([event_data])
+    
+    def _process_events(self, events):
+        """Store and handle a batch of events in a single transaction"""
+        if not events:
+            return
         
-        # Store event in database
-        streaming_event = StreamingEvent(
-            event_type=event_type,
-            data_object_id=event_data.get('data_object_id'),
-            payload=json.dumps(event_data),
-            timestamp=datetime.utcnow()
-        )
+        # Rows collected by the handlers and written once for the batch, all
+        # stamped with one batch time
+        batch = {
+            'access_logs': [], 'accessed': Counter(), 'metadata': {}, 'now': datetime.utcnow()
+        }
         
-        self.db.add(streaming_event)
+        try:
+            event_rows = [self._store_event(event_data, batch) for event_data in events]
+            
+            # Core executemany inserts; RETURNING gives back the ids (in
+            # input order) for the recent-events buffer
+            stored = self.db.execute(_INSERT_STREAMING_EVENTS, event_rows).all()
+            if batch['access_logs']:
+                self.db.execute(_INSERT_ACCESS_LOGS, batch['access_logs'])
+            if batch['metadata']:
+                self._apply_metadata_updates(batch['metadata'])
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        finally:
+            self._sessions.remove()
         
-        # Process based on event type
-        if event_type == 'data_ingestion':
-            self._handle_data_ingestion(event_data)
-        elif event_type == 'access_event':
-            self._handle_access_event(event_data)
-        elif event_type == 'migration_event':
-            self._handle_migration_event(event_data)
-        elif event_type == 'alert':
-            self._handle_alert(event_data)
+        if batch['accessed']:
+            self._record_accesses(batch['accessed'], batch['now'])
+        self._flush_access_counts()
         
-        self.db.commit()
+        self.recent.extend(StreamingEvent.serialize(row) for row in stored)
+        for data_object_id in batch['accessed']:
+            invalidate_access_stats(data_object_id)
         
-        # Notify event handlers
+        # Notify event handlers: one task per handler keeps its events in order
         for handler in self.event_handlers:
+            self._handler_slots.acquire()
             try:
-                handler(event_data)
-            except Exception as e:
-                print(f"Error in event handler: {e}")
+                self._handler_pool.submit(self._run_handler, handler, events)
+            except Exception:
+                self._handler_slots.release()
+                raise
     
-    def _handle_data_ingestion(self, event_data):
+    def _run_handler(self, handler, events):
+        """Pool task: pass a batch of events to one handler, then free its slot"""
+        try:
+            for event_data in events:
+                try:
+                    handler(event_data)
+                except Exception as e:
+                    print(f"Error in event handler: {e}")
+        finally:
+            self._handler_slots.release()
+    
+    def _store_event(self, event_data, batch):
+        """Apply an event's effects and return its streaming_events row (inserted by the caller)"""
+        event_type = event_data.get('type', 'unknown')
+        
+        # Process based on event type
+        handler = self._dispatch.get(event_type)
+        if handler:
+            handler(event_data, batch)
+        
+        return {
+            'event_type': event_type,
+            'data_object_id': event_data.get('data_object_id'),
+            'payload': event_data,
+            'timestamp': batch['now']
+        }
+    
+    def _record_accesses(self, accessed, accessed_at):
+        """Add committed accesses to the in-memory counts"""
+        with self._access_lock:
+            self._access_counter.update(accessed)
+            for data_object_id in accessed:
+                self._last_access_ts[data_object_id] = accessed_at
+            self._pending_accesses += sum(accessed.values())
+    
+    def _access_flush_loop(self):
+        """Background thread: write due access counts until the processor is closed"""
+        while not self._closed.wait(STREAMING_ACCESS_FLUSH_INTERVAL_SECONDS):
+            self._flush_access_counts()
+    
+    def _flush_access_counts(self, force=False):
+        """Add the coalesced access counts to data_objects when due"""
+        with self._access_lock:
+            if not self._access_counter:
+                return
+            due = (
+                force or
+                self._pending_accesses >= STREAMING_ACCESS_FLUSH_MAX_PENDING or
+                time.monotonic() - self._access_flushed_at >= STREAMING_ACCESS_FLUSH_INTERVAL_SECONDS
+            )
+            if not due:
+                return
+            counts, self._access_counter = self._access_counter, Counter()
+            last_access, self._last_access_ts = self._last_access_ts, {}
+            self._pending_accesses = 0
+            self._access_flushed_at = time.monotonic()
+        
+        # One executemany UPDATE: a hot object costs one row however often it was read
+        try:
+            result = self.db.execute(_ADD_ACCESS_COUNTS, [
+                {'object_id': data_object_id, 'count': count, 'last_accessed': last_access[data_object_id]}
+                for data_object_id, count in counts.items()
+            ])
+            self.db.commit()
+            
+            # Ids with no data object match no row; nothing is looked up per event
+            if result.supports_sane_multi_rowcount() and result.rowcount < len(counts):
+                print(f"Access counts for {len(counts) - result.rowcount} unknown data object(s) skipped")
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error flushing access counts: {e}")
+            
+            # Keep the counts for the next flush
+            with self._access_lock:
+                self._access_counter.update(counts)
+                for data_object_id, accessed_at in last_access.items():
+                    self._last_access_ts.setdefault(data_object_id, accessed_at)
+                self._pending_accesses += sum(counts.values())
+        finally:
+            self._sessions.remove()
+    
+    def _handle_data_ingestion(self, event_data, batch):
         """Handle new data ingestion event"""
-        # Create or update data object
+        # Update metadata of an existing data object; later events in the
+        # batch override earlier ones field by field
         data_object_id = event_data.get('data_object_id')
         if data_object_id:
-            data_object = self.db.query(DataObject).filter(
-                DataObject.id == data_object_id
-            ).first()
-            
-            if data_object:
-                # Update metadata
-                if 'size_gb' in event_data:
-                    data_object.size_gb = event_data['size_gb']
-                if 'content_type' in event_data:
-                    data_object.content_type = event_data['content_type']
-                
-                self.db.commit()
+            changes = {
+                field: event_data[field] for field in ('size_gb', 'content_type')
+                if field in event_data
+            }
+            if changes:
+                batch['metadata'].setdefault(data_object_id, {}).update(changes)
+    
+    def _apply_metadata_updates(self, metadata):
+        """Write a batch's data object metadata changes"""
+        # Direct UPDATEs (no read-modify-write), one executemany per set of
+        # changed fields; ids with no data object match no row
+        by_fields = {}
+        for data_object_id, changes in metadata.items():
+            by_fields.setdefault(tuple(sorted(changes)), []).append(
+                {'object_id': data_object_id, **changes}
+            )
+        for rows in by_fields.values():
+            self.db.execute(_UPDATE_OBJECT_METADATA, rows)
     
-    def _handle_access_event(self, event_data):
+    def _handle_access_event(self, event_data, batch):
         """Handle data access event"""
         data_object_id = event_data.get('data_object_id')
         if not data_object_id:
             return
         
-        # Create access log
-        access_log = AccessLog(
-            data_object_id=data_object_id,
-            accessed_at=datetime.utcnow(),
-            access_type=event_data.get('access_type', 'read'),
-            latency_ms=event_data.get('latency_ms'),
-            source_ip=event_data.get('source_ip')
-        )
-        
-        self.db.add(access_log)
-        
-        # Update data object access metrics
-        data_object = self.db.query(DataObject).filter(
-            DataObject.id == data_object_id
-        ).first()
-        
-        if data_object:
-            data_object.access_count += 1
-            data_object.last_accessed = datetime.utcnow()
-        
-        self.db.commit()
+        # Access log row and access count, written with the rest of the batch
+        batch['access_logs'].append({
+            'data_object_id': data_object_id,
+            'accessed_at': batch['now'],
+            'access_type': event_data.get('access_type', 'read'),
+            'latency_ms': event_data.get('latency_ms'),
+            'source_ip': event_data.get('source_ip')
+        })
+        batch['accessed'][data_object_id] += 1
     
-    def _handle_migration_event(self, event_data):
+    def _handle_migration_event(self, event_data, batch):
         """Handle migration event"""
         # Migration events are handled by migration service
         pass
     
-    def _handle_alert(self, event_data):
+    def _handle_alert(self, event_data, batch):
         """Handle alert event"""
         # Alerts can trigger automated actions
         alert_type = event_data.get('alert_type')
@@ -216,15 +454,15 @@ class StreamingProcessor:
         """Publish an event to the stream"""
         if self.use_kafka and self.producer:
             try:
+                # Delivered by the producer's sender thread within linger_ms
                 self.producer.send(topic, event_data)
-                self.producer.flush()
                 return True
             except Exception as e:
                 print(f"Error publishing to Kafka: {e}")
                 return False
         elif self.use_mqtt and self.mqtt_client:
             try:
-                self.mqtt_client.publish(topic, json.dumps(event_data))
+                self.mqtt_client.publish(topic, orjson.dumps(event_data), qos=0)
                 return True
             except Exception as e:
                 print(f"Error publishing to MQTT: {e}")
@@ -234,6 +472,32 @@ class StreamingProcessor:
             self._process_streaming_event(event_data)
             return True
     
+    def publish_events(self, topic, events):
+        """Publish a batch of events to the stream as a single message"""
+        if not events:
+            return True
+        if len(events) == 1:
+            return self.publish_event(topic, events[0])
+        
+        if self.use_kafka and self.producer:
+            try:
+                self.producer.send(topic, events)
+                return True
+            except Exception as e:
+                print(f"Error publishing to Kafka: {e}")
+                return False
+        elif self.use_mqtt and self.mqtt_client:
+            try:
+                self.mqtt_client.publish(topic, orjson.dumps(events), qos=0)
+                return True
+            except Exception as e:
+                print(f"Error publishing to MQTT: {e}")
+                return False
+        else:
+            # Simulate event processing
+            self._process_payload(events)
+            return True
+    
     def simulate_data_stream(self, interval=5):
         """Simulate continuous data stream for testing"""
         def generate_event():
@@ -271,6 +535,49 @@ class StreamingProcessor:
             generate_event()
             time.sleep(interval)
     
+    def simulate_data_stream_batch(self, n=1000):
+        """Generate and publish `n` simulated events at once (for load testing)"""
+        # Every random field for the batch in one numpy call each, rather
+        # than several random.* calls per event
+        event_types = _RNG.choice(_SIMULATED_EVENT_TYPES, n).tolist()
+        data_object_ids = _RNG.integers(1, 101, n).tolist()
+        sizes_gb = _RNG.uniform(0.1, 100, n).round(2).tolist()
+        content_types = _RNG.choice(_SIMULATED_CONTENT_TYPES, n).tolist()
+        access_types = _RNG.choice(_SIMULATED_ACCESS_TYPES, n).tolist()
+        latencies_ms = _RNG.uniform(5, 500, n).round(2).tolist()
+        hosts = _RNG.integers(1, 256, n).tolist()
+        alert_types = _RNG.choice(_SIMULATED_ALERT_TYPES, n).tolist()
+        alert_messages = _RNG.choice(_SIMULATED_ALERT_MESSAGES, n).tolist()
+        timestamp = datetime.utcnow().isoformat()
+        
+        events = []
+        for i, event_type in enumerate(event_types):
+            event_data = {'type': event_type, 'timestamp': timestamp}
+            
+            if event_type == 'data_ingestion':
+                event_data.update({
+                    'data_object_id': data_object_ids[i],
+                    'size_gb': sizes_gb[i],
+                    'content_type': content_types[i]
+                })
+            elif event_type == 'access_event':
+                event_data.update({
+                    'data_object_id': data_object_ids[i],
+                    'access_type': access_types[i],
+                    'latency_ms': latencies_ms[i],
+                    'source_ip': f"192.168.1.{hosts[i]}"
+                })
+            else:
+                event_data.update({
+                    'alert_type': alert_types[i],
+                    'message': f"Alert: {alert_messages[i]}"
+                })
+            
+            events.append(event_data)
+        
+        self.publish_events('data-stream', events)
+        return len(events)
+    
     def add_event_handler(self, handler):
         """Add custom event handler"""
         self.event_handlers.append(handler)
@@ -280,12 +587,29 @@ class StreamingProcessor:
         self.running = False
         if self.consumer:
             self.consumer.close()
+        self._flush_access_counts(force=True)
+        if self.producer:
+            # Deliver anything still lingering in the send buffer
+            self.producer.flush()
+            self.producer.close()
+            self.producer = None
         if self.mqtt_client:
             self.mqtt_client.disconnect()
+            self.mqtt_client.loop_stop()
     
-    def __del__(self):
+    def close(self):
+        """Stop processing and release the database session"""
+        if self._closed.is_set():
+            return
+        self._closed.set()
         self.stop()
-        if hasattr(self, 'db'):
-            self.db.close()
+        self._handler_pool.shutdown()
+        self._sessions.remove()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
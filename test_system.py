@@ -5,10 +5,18 @@ Verifies all components are working correctly
 """
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 # Add current directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+# ASCII status markers by default (safe on any console); TEST_UNICODE_MARKERS=1
+# switches to check marks
+if os.getenv('TEST_UNICODE_MARKERS') == '1':
+    OK, ERROR = '\u2713', '\u2717'
+else:
+    OK, ERROR = '[OK]', '[ERROR]'
+
 def test_imports():
     """Test if all modules can be imported"""
     print("Testing imports...")
@@ -20,10 +28,10 @@ def test_imports():
         from ml_predictor import MLPredictor
         from data_consistency_manager import DataConsistencyManager
         from config import STORAGE_TIERS, CLOUD_PROVIDERS
-        print("[OK] All imports successful")
+        print(f"{OK} All imports successful")
         return True
     except Exception as e:
-        print(f"[ERROR] Import error: {e}")
+        print(f"{ERROR} Import error: {e}")
         return False
 
 def test_database():
@@ -34,11 +42,11 @@ def test_database():
         init_db()
         db = SessionLocal()
         count = db.query(DataObject).count()
-        print(f"[OK] Database initialized (current objects: {count})")
+        print(f"{OK} Database initialized (current objects: {count})")
         db.close()
         return True
     except Exception as e:
-        print(f"[ERROR] Database error: {e}")
+        print(f"{ERROR} Database error: {e}")
         return False
 
 def test_optimizer():
@@ -46,11 +54,11 @@ def test_optimizer():
     print("\nTesting optimizer...")
     try:
         from data_placement_optimizer import DataPlacementOptimizer
-        optimizer = DataPlacementOptimizer()
-        print("[OK] Optimizer initialized")
+        with DataPlacementOptimizer() as optimizer:
+            print(f"{OK} Optimizer initialized")
         return True
     except Exception as e:
-        print(f"[ERROR] Optimizer error: {e}")
+        print(f"{ERROR} Optimizer error: {e}")
         return False
 
 def test_migration_service():
@@ -58,11 +66,11 @@ def test_migration_service():
     print("\nTesting migration service...")
     try:
         from migration_service import MigrationService
-        service = MigrationService()
-        print("[OK] Migration service initialized")
+        with MigrationService() as service:
+            print(f"{OK} Migration service initialized")
         return True
     except Exception as e:
-        print(f"[ERROR] Migration service error: {e}")
+        print(f"{ERROR} Migration service error: {e}")
         return False
 
 def test_streaming_processor():
@@ -70,11 +78,59 @@ def test_streaming_processor():
     print("\nTesting streaming processor...")
     try:
         from streaming_processor import StreamingProcessor
-        processor = StreamingProcessor(use_kafka=False, use_mqtt=False)
-        print("[OK] Streaming processor initialized")
+        with StreamingProcessor(use_kafka=False, use_mqtt=False) as processor:
+            print(f"{OK} Streaming processor initialized")
         return True
     except Exception as e:
-        print(f"[ERROR] Streaming processor error: {e}")
+        print(f"{ERROR} Streaming processor error: {e}")
+        return False
+
+def test_streaming_ingest():
+    """Test simulated events are stored, counted and applied"""
+    print("\nTesting streaming ingest...")
+    try:
+        from collections import Counter
+        from models import init_db, SessionLocal, DataObject, AccessLog, StreamingEvent
+        from streaming_processor import StreamingProcessor
+        init_db()
+        
+        # Simulated events target data objects 1-100; seed any that are missing
+        db = SessionLocal()
+        existing = {row.id for row in db.query(DataObject.id).filter(DataObject.id <= 100)}
+        db.add_all([
+            DataObject(id=i, name=f"stream-test-{i}", size_gb=1.0, current_tier='warm',
+                       current_location='AWS S3 Standard-IA', access_count=0)
+            for i in range(1, 101) if i not in existing
+        ])
+        db.commit()
+        access_before = dict(db.query(DataObject.id, DataObject.access_count).filter(DataObject.id <= 100))
+        events_before = db.query(StreamingEvent).count()
+        logs_before = db.query(AccessLog).count()
+        db.close()
+        
+        events = []
+        with StreamingProcessor(use_kafka=False, use_mqtt=False) as processor:
+            processor.add_event_handler(events.append)
+            published = processor.simulate_data_stream_batch(200)
+            processor.stop()
+            recent = len(processor.recent)
+        
+        accesses = Counter(e['data_object_id'] for e in events if e['type'] == 'access_event')
+        sizes = {e['data_object_id']: e['size_gb'] for e in events if e['type'] == 'data_ingestion'}
+        
+        db = SessionLocal()
+        assert len(events) == published == recent == 200
+        assert db.query(StreamingEvent).count() - events_before == 200
+        assert db.query(AccessLog).count() - logs_before == sum(accesses.values())
+        for obj in db.query(DataObject).filter(DataObject.id <= 100):
+            assert obj.access_count == access_before[obj.id] + accesses[obj.id]
+            if obj.id in sizes:
+                assert obj.size_gb == sizes[obj.id]
+        db.close()
+        print(f"{OK} Streaming ingest stored {published} events")
+        return True
+    except Exception as e:
+        print(f"{ERROR} Streaming ingest error: {e!r}")
         return False
 
 def test_ml_predictor():
@@ -82,11 +138,11 @@ def test_ml_predictor():
     print("\nTesting ML predictor...")
     try:
         from ml_predictor import MLPredictor
-        predictor = MLPredictor()
-        print("[OK] ML predictor initialized")
+        with MLPredictor() as predictor:
+            print(f"{OK} ML predictor initialized")
         return True
     except Exception as e:
-        print(f"[ERROR] ML predictor error: {e}")
+        print(f"{ERROR} ML predictor error: {e}")
         return False
 
 def test_consistency_manager():
@@ -95,10 +151,10 @@ def test_consistency_manager():
     try:
         from data_consistency_manager import DataConsistencyManager
         manager = DataConsistencyManager()
-        print("[OK] Consistency manager initialized")
+        print(f"{OK} Consistency manager initialized")
         return True
     except Exception as e:
-        print(f"[ERROR] Consistency manager error: {e}")
+        print(f"{ERROR} Consistency manager error: {e}")
         return False
 
 def test_config():
@@ -109,14 +165,22 @@ def test_config():
         assert 'hot' in STORAGE_TIERS
         assert 'warm' in STORAGE_TIERS
         assert 'cold' in STORAGE_TIERS
-        print("[OK] Configuration loaded correctly")
+        print(f"{OK} Configuration loaded correctly")
         return True
     except Exception as e:
-        print(f"[ERROR] Configuration error: {e}")
+        print(f"{ERROR} Configuration error: {e}")
+        return False
+
+def _run_test(name):
+    """Run one test by name, counting an exception as a failure"""
+    try:
+        return globals()[name]()
+    except Exception as e:
+        print(f"{ERROR} Test failed with exception: {e}")
         return False
 
 def main():
-    """Run all tests"""
+    """Run all tests (--parallel runs each in its own process)"""
     print("=" * 60)
     print("NetApp Intelligent Data Management System - Test Suite")
     print("=" * 60)
@@ -128,18 +192,18 @@ def main():
         test_optimizer,
         test_migration_service,
         test_streaming_processor,
+        test_streaming_ingest,
         test_ml_predictor,
         test_consistency_manager
     ]
     
-    results = []
-    for test in tests:
-        try:
-            result = test()
-            results.append(result)
-        except Exception as e:
-            print(f"[ERROR] Test failed with exception: {e}")
-            results.append(False)
+    names = [test.__name__ for test in tests]
+    if '--parallel' in sys.argv[1:]:
+        # The tests share no state; output from different tests may interleave
+        with ProcessPoolExecutor() as executor:
+            results = list(executor.map(_run_test, names))
+    else:
+        results = [_run_test(name) for name in names]
     
     print("\n" + "=" * 60)
     print(f"Test Results: {sum(results)}/{len(results)} passed")